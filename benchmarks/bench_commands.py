@@ -0,0 +1,65 @@
+"""
+比较两种生成命令的方式：复制模板填字段后json.dumps，和CommandEncoder拼接预先序列化的字节
+
+    python benchmarks/bench_commands.py [--number 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mqtt_commands  # noqa: E402
+
+GCODE = 'G1 X120.5 Y80.25 E0.0421 F3000\n' * 10
+
+
+def dumps_template(template: dict, sequence_id: str, param=None) -> bytes:
+    # 原来的做法
+    (section, body), = template.items()
+    body = dict(body, sequence_id=sequence_id)
+    if param is not None:
+        body['param'] = param
+    return json.dumps({section: body}).encode()
+
+
+def peak_memory(func, number: int = 1000) -> int:
+    """
+    :return: 一次调用期间的峰值临时内存（字节），包括返回的结果
+    """
+    tracemalloc.start()
+    func()  # 首次调用的缓存等不计入
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for _ in range(number):
+        func()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='command encoding benchmark')
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    cases = [
+        ('pause', mqtt_commands.PAUSE, None),
+        ('print_speed', mqtt_commands.SPEED_PROFILE_TEMPLATE, '2'),
+        ('gcode_line', mqtt_commands.SEND_GCODE_TEMPLATE, GCODE),
+    ]
+    for name, template, param in cases:
+        encoder = mqtt_commands.encoder(template)
+        assert encoder.encode('12345', param) == dumps_template(template, '12345', param)
+
+        for method, func in (('json.dumps', lambda: dumps_template(template, '12345', param)),
+                             ('encoder', lambda: encoder.encode('12345', param))):
+            per_call = min(timeit.repeat(func, number=args.number, repeat=5)) / args.number
+            print(f'{name:<12} {method:<11} {per_call * 1e6:7.2f} us/cmd {peak_memory(func):8d} B peak')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+比较各JSON后端解析打印机报告的速度
+
+    python benchmarks/bench_json.py [--payloads benchmarks/payloads.jsonl] [--number 2000]
+
+payloads文件每行一条原始报告
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mqtt_json  # noqa: E402
+
+DEFAULT_PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payloads.jsonl')
+
+
+def load_payloads(path: str) -> list:
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') for line in f if line.strip()]
+
+
+def bench(loads, payloads: list, number: int) -> float:
+    """
+    :return: 每条报告的平均耗时（秒）
+    """
+    def run():
+        for payload in payloads:
+            loads(payload)
+
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / number / len(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON backend benchmark')
+    parser.add_argument('--payloads', default=DEFAULT_PAYLOADS)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads)
+    total_bytes = sum(len(p) for p in payloads)
+    print(f'{len(payloads)} payloads, {total_bytes} bytes, default backend: {mqtt_json.BACKEND}')
+
+    # 原来的做法：先decode成str再用标准库解析
+    cases = [('json (decode + str)', lambda payload: json.loads(payload.decode()))]
+    for name in mqtt_json.BACKENDS:
+        try:
+            loads = mqtt_json.get_backend(name)
+        except ImportError:
+            print(f'{name}: not installed')
+            continue
+        cases.append((f'{name} (bytes)', loads))
+
+    baseline = None
+    for name, loads in cases:
+        per_message = bench(loads, payloads, args.number)
+        baseline = baseline or per_message
+        throughput = total_bytes / len(payloads) / per_message / 1e6
+        print(f'{name:<22} {per_message * 1e6:8.2f} us/msg {throughput:8.1f} MB/s {baseline / per_message:6.2f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+整个程序的资源占用测试：空闲CPU、内存、每秒唤醒次数
+
+    python harness.py --duration 60                                 # 连接一台模拟打印机
+    python harness.py --printers 1 --rate 5 --output report.json
+    python harness.py --replay session.rec --speed 720 --duration 60 # 1分钟回放12小时的录制
+
+在Qt的offscreen平台上以子进程启动主窗口，由本进程按固定间隔采样子进程的
+CPU时间、RSS和上下文切换次数（近似唤醒次数），结束后输出JSON报告。
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_proc_sample(pid: int, thread_switches: dict) -> dict:
+    """
+    从/proc读取进程的资源占用，唤醒次数按所有线程的上下文切换累加
+    :param thread_switches: 各线程最近一次读到的切换次数，跨采样保留，已退出线程的次数不会丢失
+    """
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+
+    rss = 0
+    with open(f'/proc/{pid}/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+
+    for tid in os.listdir(f'/proc/{pid}/task'):
+        switches = 0
+        try:
+            with open(f'/proc/{pid}/task/{tid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith(('voluntary_ctxt_switches:', 'nonvoluntary_ctxt_switches:')):
+                        switches += int(line.split()[1])
+        except FileNotFoundError:
+            continue  # 线程已退出
+        thread_switches[tid] = switches
+
+    return {'cpu_s': cpu, 'rss_bytes': rss, 'switches': sum(thread_switches.values())}
+
+
+def read_psutil_sample(pid: int) -> dict:
+    import psutil
+    process = psutil.Process(pid)
+    cpu = process.cpu_times()
+    switches = process.num_ctx_switches()
+    return {'cpu_s': cpu.user + cpu.system,
+            'rss_bytes': process.memory_info().rss,
+            'switches': switches.voluntary + switches.involuntary}
+
+
+def read_sample(pid: int, thread_switches: dict) -> dict:
+    if os.path.exists(f'/proc/{pid}/task'):
+        sample = read_proc_sample(pid, thread_switches)
+    else:
+        sample = read_psutil_sample(pid)
+    sample['time'] = time.monotonic()
+    return sample
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'simulator did not open port {port}')
+
+
+def run_app(args):
+    """
+    子进程：在offscreen平台上运行主窗口，直到被父进程结束
+    不安装信号处理，免得为了让Python处理信号而定时唤醒
+    """
+    from PySide6.QtWidgets import QApplication
+    from mqtt_engine import MonitorEngine, create_engine
+    from mqtt_mainwindow import MainWindow
+
+    os.chdir(ROOT)  # 主窗口按相对路径读取翻译
+    app = QApplication([])
+    app.setStyle('Fusion')
+
+    config = json.loads(args.app_config)
+    if args.replay:
+        from mqtt_replay import ReplaySource
+        engine = MonitorEngine(ReplaySource(args.replay, speed=args.speed, repeat=args.repeat))
+    else:
+        engine = create_engine(config)
+    window = MainWindow(engine, config)
+    window.show()
+    app.exec()
+
+
+def summarize(samples: list, warmup: int) -> dict:
+    measured = samples[warmup:]
+    first, last = measured[0], measured[-1]
+    elapsed = last['time'] - first['time']
+    cpu = last['cpu_s'] - first['cpu_s']
+    switches = last['switches'] - first['switches']
+    rss = [s['rss_bytes'] for s in measured]
+    return {
+        'window_s': elapsed,
+        'cpu_s': cpu,
+        'cpu_percent': cpu / elapsed * 100 if elapsed else 0,
+        'wakeups_per_s': switches / elapsed if elapsed else 0,
+        'rss_start_mb': rss[0] / 2 ** 20,
+        'rss_end_mb': rss[-1] / 2 ** 20,
+        'rss_max_mb': max(rss) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Whole-application resource harness')
+    parser.add_argument('--duration', type=float, default=60, help='采样时长（秒），不含预热')
+    parser.add_argument('--interval', type=float, default=1, help='采样间隔（秒）')
+    parser.add_argument('--warmup', type=float, default=5, help='启动后先等待多久再开始统计（秒）')
+    parser.add_argument('--printers', type=int, default=1, help='模拟打印机数量（程序只连接第一台）')
+    parser.add_argument('--rate', type=float, default=1, help='模拟打印机每秒推送的报告数')
+    parser.add_argument('--replay', metavar='PATH', help='改用回放录制文件作为报告来源')
+    parser.add_argument('--speed', type=float, default=1, help='回放倍速')
+    parser.add_argument('--repeat', type=int, default=1, help='回放重复次数')
+    parser.add_argument('--max-fps', type=float, help='界面最大刷新帧率')
+    parser.add_argument('--output', help='把报告写入文件，默认输出到标准输出')
+    parser.add_argument('--run-app', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--app-config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_app:
+        run_app(args)
+        return
+
+    config = {}
+    if args.max_fps:
+        config['max_fps'] = args.max_fps
+
+    simulator = None
+    if not args.replay:
+        port = free_port()
+        simulator = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'mqtt_simulator.py'), '--host', '127.0.0.1', '--port', str(port),
+             '--printers', str(args.printers), '--rate', str(args.rate)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(port)
+        config.update({'username': 'bblp', 'lan_code': '12345678', 'sn': 'SIM00000',
+                       'ip': '127.0.0.1', 'port': port})
+
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    command = [sys.executable, os.path.abspath(__file__), '--run-app', '--app-config', json.dumps(config)]
+    if args.replay:
+        command += ['--replay', os.path.abspath(args.replay), '--speed', str(args.speed), '--repeat', str(args.repeat)]
+    app = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    samples = []
+    thread_switches = {}
+    warmup = int(args.warmup / args.interval)
+    try:
+        for _ in range(warmup + int(args.duration / args.interval) + 1):
+            if app.poll() is not None:
+                break
+            samples.append(read_sample(app.pid, thread_switches))
+            time.sleep(args.interval)
+    finally:
+        app.terminate()
+        app.wait(10)
+        if simulator is not None:
+            simulator.terminate()
+            simulator.wait(10)
+
+    if len(samples) <= warmup + 1:
+        print('app exited before the measurement window', file=sys.stderr)
+        sys.exit(1)
+
+    report = {
+        'source': 'replay' if args.replay else 'simulator',
+        'replay': args.replay,
+        'speed': args.speed if args.replay else None,
+        'printers': None if args.replay else args.printers,
+        'rate': None if args.replay else args.rate,
+        'interval_s': args.interval,
+        'summary': summarize(samples, warmup),
+        'samples': [{'t': s['time'] - samples[0]['time'], 'cpu_s': s['cpu_s'], 'rss_bytes': s['rss_bytes'],
+                     'switches': s['switches']} for s in samples],
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+asyncio版的打印机客户端，一个事件循环里可以同时跑几百个，不需要每台打印机一个线程
+
+    async with AsyncPrinterClient('bblp', '12345678', 'SN', '192.168.1.10', 8883) as client:
+        print(await client.request(mqtt_commands.GET_VERSION))
+        async for delta in client.reports():
+            print(delta.mask, delta.values)
+"""
+import asyncio
+import math
+import socket
+import threading
+
+import paho.mqtt.client as mqtt
+
+import mqtt_commands
+from mqtt_coalescer import DeltaCoalescer
+from mqtt_connection import ReconnectBackoff
+from mqtt_engine import MonitorEngine, EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_STATE
+from mqtt_resync import ResyncPolicy
+from mqtt_state import StateDelta
+from mqtt_tls import get_tls_context
+from mqtt_watchdog import Watchdog
+
+
+class AsyncMqttConnection:
+    """
+    由asyncio事件循环驱动的MQTT连接，接口与MqttConnection相同，可以直接交给MonitorEngine
+    socket通过add_reader/add_writer挂到事件循环上，回调都在事件循环线程中执行
+    """
+
+    def __init__(self, username: str, lan_code: str, sn: str, ip: str, port: int, keepalive: int = 60):
+        self.username = username
+        self.lan_code = lan_code
+        self.sn = sn
+        self.ip = ip
+        self.port = port
+        self.keepalive = keepalive
+
+        self.report_topic = f"device/{sn}/report"
+        self.request_topic = f"device/{sn}/request"
+
+        self.on_connected = None  # () -> None
+        self.on_disconnected = None  # (rc: int) -> None
+        self.on_payload = None  # (payload: bytes) -> None
+        self.on_tick = None  # () -> None，连接期间约每秒调用一次
+
+        self.loop = None
+        self.loop_thread = None
+        self.sock = None
+        self.stopping = False
+        self.backoff = ReconnectBackoff()
+        self.connect_task = None
+        self.disconnected = None  # 连接断开时完成的Future
+        self.tick_handle = None
+        self.publish_futures = {}  # mid -> Future
+        self.early_timers = []  # start()之前设置的定时器
+
+        self.tls_context = get_tls_context()
+        self.client = mqtt.Client()
+        self.client.tls_set_context(self.tls_context)
+        self.client.username_pw_set(self.username, self.lan_code)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self):
+        """
+        必须在事件循环中调用
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.stopping = False
+        for delay, callback in self.early_timers:
+            self.loop.call_later(delay, callback)
+        self.early_timers.clear()
+        self.connect_task = self.loop.create_task(self._connect_forever())
+
+    def stop(self):
+        self.stopping = True
+        if self.connect_task is not None:
+            self.connect_task.cancel()
+            self.connect_task = None
+        if self.sock is not None:
+            # 立即写出DISCONNECT，写完后paho会关闭socket
+            self.client.disconnect()
+            self.client.loop_write()
+
+    def reconnect(self):
+        """
+        丢弃当前连接并按重连策略重新连接
+        """
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def call_later(self, delay: float, callback):
+        """
+        delay秒后在事件循环中执行callback，与是否连接无关，可以从任意线程调用
+        """
+        if self.loop is None:
+            self.early_timers.append((delay, callback))
+        elif threading.get_ident() == self.loop_thread:
+            self.loop.call_later(delay, callback)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback)
+
+    def publish(self, msg, key=None, priority=None) -> mqtt.MQTTMessageInfo:
+        return self.client.publish(self.request_topic, msg)
+
+    def wait_published(self, info: mqtt.MQTTMessageInfo) -> asyncio.Future:
+        """
+        :return: 消息写入socket后完成的Future
+        """
+        future = self.loop.create_future()
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_exception(ConnectionError(mqtt.error_string(info.rc)))
+        elif info.is_published():
+            future.set_result(None)
+        else:
+            self.publish_futures[info.mid] = future
+        return future
+
+    async def _connect_forever(self):
+        while not self.stopping:
+            try:
+                # TCP连接和TLS握手是阻塞的，放到默认线程池里执行
+                await self.loop.run_in_executor(None, self.client.connect, self.ip, self.port, self.keepalive)
+            except Exception as e:
+                # 除了网络错误，TLS和paho也可能抛出其他异常，都不能结束重连；任务取消是BaseException，不受影响
+                print(f"连接失败 {self.sn} {e!r}")
+            else:
+                self.disconnected = self.loop.create_future()
+                await self.disconnected
+            await asyncio.sleep(self.backoff.next_delay())
+
+    def _call(self, callback, *args):
+        # paho的socket回调可能在线程池中触发
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_readable(self):
+        sock = self.sock
+        self.client.loop_read()
+        # TLS层可能已经解密了更多数据，socket上不会再有可读事件
+        while self.sock is sock and sock is not None and sock.pending():
+            self.client.loop_read()
+
+    def _on_writable(self):
+        self.client.loop_write()
+        if not self.client.want_write() and self.sock is not None:
+            self.loop.remove_writer(self.sock)
+
+    def _schedule_tick(self):
+        # 对齐到整秒，所有连接的keepalive检查在同一次唤醒里完成
+        self.tick_handle = self.loop.call_at(math.floor(self.loop.time()) + 1, self._tick)
+
+    def _tick(self):
+        self.client.loop_misc()
+        if self.sock is not None:
+            if self.on_tick is not None:
+                self.on_tick()
+            self._schedule_tick()
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._register_socket, sock)
+
+    def _register_socket(self, sock):
+        self.sock = sock
+        self.tls_context.remember_session(sock)
+        self.loop.add_reader(sock, self._on_readable)
+        if self.client.want_write():
+            self.loop.add_writer(sock, self._on_writable)
+        self._schedule_tick()
+        if self.stopping:
+            # 连接建立前已经调用了stop()
+            self.stop()
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._unregister_socket, sock)
+
+    def _unregister_socket(self, sock):
+        self.tls_context.remember_session(sock)
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.tick_handle is not None:
+            self.tick_handle.cancel()
+            self.tick_handle = None
+        if self.sock is sock:
+            self.sock = None
+        # 唤醒_connect_forever重连
+        if self.disconnected is not None and not self.disconnected.done():
+            self.disconnected.set_result(None)
+        for future in self.publish_futures.values():
+            if not future.done():
+                future.set_exception(ConnectionError('connection lost'))
+        self.publish_futures.clear()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self._on_writable)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.backoff.reset()
+            client.subscribe(self.report_topic)
+            if self.on_connected is not None:
+                self.on_connected()
+        else:
+            print(f"连接失败 {self.sn} 错误码 {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        if self.on_disconnected is not None:
+            self.on_disconnected(rc)
+
+    def _on_message(self, client, userdata, msg):
+        if self.on_payload is not None:
+            self.on_payload(msg.payload)
+
+    def _on_publish(self, client, userdata, mid):
+        future = self.publish_futures.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+class ReportStream:
+    """
+    状态增量的异步迭代器，消费者跟不上时增量会合并，不会无限堆积
+    """
+
+    def __init__(self, client: 'AsyncPrinterClient'):
+        self.client = client
+        self.coalescer = DeltaCoalescer()
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    def push(self, delta: StateDelta):
+        if self.coalescer.push(delta):
+            self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> StateDelta:
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            delta = self.coalescer.take()
+            if delta:
+                return delta
+            if self.closed:
+                self.client.streams.discard(self)
+                raise StopAsyncIteration
+
+    async def aclose(self):
+        self.close()
+        self.client.streams.discard(self)
+
+
+class AsyncPrinterClient:
+    """
+    asyncio版的打印机客户端：连接 + 状态模型 + 增量流
+    """
+
+    def __init__(self, username: str, lan_code: str, sn: str, ip: str, port: int, keepalive: int = 60,
+                 watchdog: Watchdog = None, resync: ResyncPolicy = None):
+        self.connection = AsyncMqttConnection(username, lan_code, sn, ip, port, keepalive)
+        self.engine = MonitorEngine(self.connection, watchdog, resync)
+        self.engine.add_listener(self._on_engine_event)
+        self.sn = sn
+        self.state = self.engine.state
+        self.streams = set()
+        self.connected = asyncio.Event()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self, timeout: float = None):
+        """
+        连接并等待打印机接受，断线后会自动重连直到disconnect()
+        """
+        self.engine.start()
+        await asyncio.wait_for(self.connected.wait(), timeout)
+
+    async def disconnect(self):
+        self.engine.stop()
+        for stream in list(self.streams):
+            stream.close()
+        self.connected.clear()
+
+    async def publish(self, msg):
+        """
+        发送命令，写入socket后返回；未连接或发送前断开时抛出ConnectionError
+        """
+        await self.connection.wait_published(self.connection.publish(msg))
+
+    async def request(self, template: dict, param=None, timeout: float = None) -> dict:
+        """
+        发送命令并等待打印机的回复，见MonitorEngine.request
+        :return: 回复内容，超时抛出CommandTimeout
+        """
+        return await asyncio.wrap_future(self.engine.request(template, param, timeout))
+
+    async def push_all(self):
+        await self.publish(mqtt_commands.encoder(mqtt_commands.PUSH_ALL).encode())
+
+    def reports(self) -> ReportStream:
+        """
+        订阅状态增量：async for delta in client.reports()
+        disconnect()后迭代结束
+        """
+        stream = ReportStream(self)
+        self.streams.add(stream)
+        return stream
+
+    def _on_engine_event(self, event: str, data):
+        if event == EVENT_STATE:
+            for stream in self.streams:
+                stream.push(data)
+        elif event == EVENT_CONNECTED:
+            self.connected.set()
+        elif event == EVENT_DISCONNECTED:
+            self.connected.clear()
+
+
+def create_async_client(config: dict) -> AsyncPrinterClient:
+    """
+    按config.json的内容创建客户端
+    """
+    return AsyncPrinterClient(
+        username=config['username'],
+        lan_code=config['lan_code'],
+        sn=config['sn'],
+        ip=config['ip'],
+        port=config['port'],
+        keepalive=config.get('keepalive', 60),
+        watchdog=Watchdog(**config.get('watchdog', {})),
+        resync=ResyncPolicy(**config.get('resync', {})),
+    )
@@ -0,0 +1,34 @@
+import threading
+
+from mqtt_state import StateDelta
+
+
+class DeltaCoalescer:
+    """
+    合并网络线程产生的状态增量，只保留每个字段的最新值
+    GUI按自己的帧率取走合并结果，中间无论来了多少条报告，待处理的数据量都不会超过一份完整状态
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = StateDelta()
+
+    def push(self, delta: StateDelta) -> bool:
+        """
+        合并一条增量
+        :param delta: 状态增量
+        :return: 合并前是否为空，为True时需要通知消费者来取
+        """
+        with self.lock:
+            was_empty = not self.pending
+            self.pending.merge(delta)
+            return was_empty
+
+    def take(self) -> StateDelta:
+        """
+        取走目前累积的增量
+        """
+        with self.lock:
+            delta = self.pending
+            self.pending = StateDelta()
+            return delta
@@ -1,4 +1,7 @@
 """MQTT Commands"""
+import json
+from json.encoder import encode_basestring_ascii
+
 CHAMBER_LIGHT_ON = {
     "system": {"sequence_id": "0", "command": "ledctrl", "led_node": "chamber_light", "led_mode": "on",
                "led_on_time": 500, "led_off_time": 500, "loop_times": 0, "interval_time": 0}}
@@ -23,3 +26,78 @@ SEND_GCODE_TEMPLATE = {
 
 # X1 only currently
 GET_ACCESSORIES = {"system": {"sequence_id": "0", "command": "get_accessories", "accessory_type": "none"}}
+
+
+# 序列化模板时占位用，不会出现在真实命令中
+_SEQUENCE_MARK = '\x00sequence_id\x00'
+_PARAM_MARK = '\x00param\x00'
+
+
+class CommandEncoder:
+    """
+    预先序列化的命令：模板的静态部分只序列化一次，发送时只拼接sequence_id和param
+    输出与json.dumps(填好字段的模板).encode()完全相同，不修改模板，创建后不再改变，可以多线程共用
+    """
+    __slots__ = ('section', 'command', 'parts', 'sequence_id', 'param')
+
+    def __init__(self, template: dict):
+        """
+        :param template: 本模块中的命令，如PAUSE，只有一个顶层键
+        """
+        (section, body), = template.items()
+        self.section = section
+        self.command = body['command']
+
+        marked = dict(body, sequence_id=_SEQUENCE_MARK)
+        if 'param' in body:
+            marked['param'] = _PARAM_MARK
+        text = json.dumps({section: marked})
+        head, tail = text.split(json.dumps(_SEQUENCE_MARK))
+        parts = [head.encode()]
+        if 'param' in body:
+            # param在sequence_id之后，这是所有模板的字段顺序
+            middle, tail = tail.split(json.dumps(_PARAM_MARK))
+            parts.append(middle.encode())
+        parts.append(tail.encode())
+        self.parts = tuple(parts)
+
+        self.sequence_id = _encode_value(body['sequence_id'])
+        self.param = _encode_value(body['param']) if 'param' in body else None
+
+    def encode(self, sequence_id=None, param=None) -> bytes:
+        """
+        :param sequence_id: None表示使用模板中的值
+        :param param: None表示使用模板中的值，模板没有param字段时不能指定
+        """
+        sequence_id = self.sequence_id if sequence_id is None else _encode_value(str(sequence_id))
+        if self.param is None:
+            if param is not None:
+                raise ValueError(f'{self.command} has no param')
+            head, tail = self.parts
+            return b''.join((head, sequence_id, tail))
+        head, middle, tail = self.parts
+        return b''.join((head, sequence_id, middle, self.param if param is None else _encode_value(param), tail))
+
+
+def _encode_value(value) -> bytes:
+    # 与json.dumps的默认设置（ensure_ascii）一致
+    if isinstance(value, str):
+        return encode_basestring_ascii(value).encode()
+    return json.dumps(value).encode()
+
+
+# 只缓存本模块中的命令模板，调用方临时构造的字典不缓存，避免长时间运行时不断增长
+_encoders = {id(template): (template, CommandEncoder(template))
+             for name, template in list(globals().items())
+             if name.isupper() and not name.startswith('_') and isinstance(template, dict)}
+
+
+def encoder(template: dict) -> CommandEncoder:
+    """
+    取得模板对应的编码器，本模块中的模板在导入时创建好，之后复用；其他字典每次新建，不缓存
+    模板视为常量，修改本模块中的模板不会生效
+    """
+    entry = _encoders.get(id(template))
+    if entry is not None and entry[0] is template:
+        return entry[1]
+    return CommandEncoder(template)
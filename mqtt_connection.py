@@ -0,0 +1,290 @@
+import random
+import socket
+
+import paho.mqtt.client as mqtt
+
+from mqtt_loop import NetworkLoop
+from mqtt_queue import CommandQueue, CommandHandle, DROPPED
+from mqtt_tls import get_tls_context
+
+# 每次从发送队列交给paho的命令数，写完后再取下一批，排队的命令留在队列里而不是paho的缓冲区
+# 这样紧急命令最多排在一批命令之后
+DRAIN_BATCH = 8
+
+
+class ReconnectBackoff:
+    """
+    断线重连的等待时间：第一次很快重试，之后按指数增长，
+    每次都加随机抖动，避免一大批打印机在网络恢复的同一时刻一起重连
+    """
+
+    def __init__(self, first: float = 0.5, base: float = 1, maximum: float = 120):
+        """
+        :param first: 第一次重试的等待上限（秒）
+        :param base: 第二次重试的等待时间（秒），之后每次翻倍
+        :param maximum: 等待时间上限（秒）
+        """
+        self.first = first
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        if self.attempts == 0:
+            delay = random.uniform(0, self.first)
+        else:
+            # 一半固定一半随机，既打散重连时间，又不会退化成立即重试
+            cap = min(self.maximum, self.base * 2 ** (self.attempts - 1))
+            delay = cap / 2 + random.uniform(0, cap / 2)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        """
+        连接成功后调用
+        """
+        self.attempts = 0
+
+
+class MqttConnection:
+    """
+    到打印机的MQTT连接，不依赖Qt
+    socket由NetworkLoop驱动，多个连接可以共用一个循环线程，收到的消息通过回调交给上层
+    """
+
+    def __init__(self, username: str, lan_code: str, sn: str, ip: str, port: int,
+                 loop: NetworkLoop = None, keepalive: int = 60, queue: CommandQueue = None):
+        """
+        :param loop: 共用的网络循环，None表示自己创建一个，随start()/stop()启停
+        :param queue: 发送队列，None表示使用默认大小和策略
+        """
+        self.username = username
+        self.lan_code = lan_code
+        self.sn = sn
+        self.ip = ip
+        self.port = port
+        self.keepalive = keepalive
+
+        self.report_topic = f"device/{sn}/report"
+        self.request_topic = f"device/{sn}/request"
+
+        # 回调在网络循环线程中执行
+        self.on_connected = None  # () -> None
+        self.on_disconnected = None  # (rc: int) -> None
+        self.on_payload = None  # (payload: bytes) -> None
+        self.on_tick = None  # () -> None，连接期间约每秒调用一次
+
+        # 单台打印机时只有一个连接，一个连接线程就够了；不能在循环线程里连接，否则握手卡住时stop()也要等
+        self.own_loop = loop is None
+        self.loop = loop if loop is not None else NetworkLoop(name=f"mqtt-{sn}", connect_workers=1)
+
+        self.sock = None
+        self.connected = False
+        self.stopping = False
+        self.connecting = False
+        self.backoff = ReconnectBackoff()
+        self.reconnect_handle = None
+
+        self.queue = queue if queue is not None else CommandQueue()
+        self.queue.on_ready = self._on_queue_ready
+        self.in_flight = {}  # mid -> CommandHandle，已交给paho还没写出的命令
+
+        # 所有连接共用同一个TLS上下文，不必每个连接都创建一份
+        self.tls_context = get_tls_context()
+        self.client = mqtt.Client()
+        self.client.tls_set_context(self.tls_context)
+        self.client.username_pw_set(self.username, self.lan_code)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        # 设置了这些回调后paho不再在调用线程里直接写socket，读写都交给网络循环
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self):
+        self.stopping = False
+        if self.own_loop:
+            self.loop.start()
+        self.loop.call_soon(self._connect)
+
+    def stop(self):
+        self.stopping = True  # 让正在进行的连接完成后自行关闭，见_blocking_connect
+        self.loop.call_soon(self._stop)
+        if self.own_loop:
+            self.loop.stop()
+
+    def reconnect(self):
+        """
+        丢弃当前连接并按重连策略重新连接，用于发现连接已经失效但TCP还没有断开时
+        """
+        self._call(self._drop)
+
+    def call_later(self, delay: float, callback):
+        """
+        delay秒后在网络线程中执行callback，与是否连接无关，可以从任意线程调用
+        """
+        self.loop.call_later(delay, callback)
+
+    def publish(self, msg, key=None, priority: int = None) -> CommandHandle:
+        """
+        命令放入发送队列后立即返回，可以从任意线程调用，断线期间的命令在重连后发出
+        :param key: 合并用的键，见CommandQueue.put
+        :param priority: 优先级通道，见CommandQueue.put
+        """
+        # 网络线程自己发送时不能等待队列空位，否则没有人来取
+        return self.queue.put(msg, key, block=not self.loop.in_loop_thread(), priority=priority)
+
+    def _on_queue_ready(self):
+        self._call(self._drain)
+
+    def _drain(self):
+        # paho的缓冲区还有没写完的数据时先不取，写完后on_writable会再调用
+        if not self.connected or self.client.want_write():
+            return
+        for handle in self.queue.take(DRAIN_BATCH):
+            info = self.client.publish(self.request_topic, handle.msg)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.in_flight[info.mid] = handle
+            else:
+                handle.finish(DROPPED)
+
+    def _call(self, callback, *args):
+        # paho的socket回调可能在连接线程中触发
+        if self.loop.in_loop_thread():
+            callback(*args)
+        else:
+            self.loop.call_soon(callback, *args)
+
+    def _connect(self):
+        self.reconnect_handle = None
+        if self.stopping or self.connecting:
+            return
+        self.connecting = True
+        # TCP连接和TLS握手是阻塞的，放到线程池里执行
+        self.loop.run_in_executor(self._blocking_connect, self._on_connect_done)
+
+    def _blocking_connect(self):
+        # 在连接线程中执行
+        self.client.connect(self.ip, self.port, self.keepalive)
+        if self.stopping and self.own_loop:
+            # 自己的循环可能已经退出，_on_connect_done不会再执行，直接关掉刚建立的连接
+            sock = self.client.socket()
+            if sock is not None:
+                sock.close()
+
+    def _on_connect_done(self, result, error):
+        self.connecting = False
+        if error is not None:
+            print(f"连接失败 {self.sn} {error}")
+            self._schedule_reconnect()
+        elif self.stopping:
+            self._disconnect()
+
+    def _schedule_reconnect(self):
+        if self.stopping or self.reconnect_handle is not None:
+            return
+        self.reconnect_handle = self.loop.call_later(self.backoff.next_delay(), self._connect)
+
+    def _stop(self):
+        self.stopping = True
+        if self.reconnect_handle is not None:
+            self.reconnect_handle.cancel()
+            self.reconnect_handle = None
+        self._disconnect()
+
+    def _drop(self):
+        # 关闭后socket立即变为可读，loop_read读到EOF后按断线处理
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _disconnect(self):
+        # 立即写出DISCONNECT，写完后paho会关闭socket
+        if self.sock is not None:
+            self.client.disconnect()
+            self.client.loop_write()
+
+    # NetworkLoop回调
+
+    def on_readable(self):
+        sock = self.sock
+        self.client.loop_read()
+        # TLS层可能已经解密了更多数据，socket上不会再有可读事件
+        while self.sock is sock and sock is not None and sock.pending():
+            self.client.loop_read()
+
+    def on_writable(self):
+        self.client.loop_write()
+        if not self.client.want_write():
+            self.loop.set_writable(self.sock, False)
+            if self.queue:
+                self._drain()
+
+    def tick(self):
+        # keepalive：按需发送PINGREQ，超时未收到PINGRESP则断开
+        self.client.loop_misc()
+        if self.on_tick is not None and self.sock is not None:
+            self.on_tick()
+
+    # paho回调
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._register_socket, sock)
+
+    def _register_socket(self, sock):
+        self.sock = sock
+        self.tls_context.remember_session(sock)
+        self.loop.register(sock, self, writable=self.client.want_write())
+        self.loop.add_ticker(self)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._unregister_socket, sock)
+
+    def _unregister_socket(self, sock):
+        self.tls_context.remember_session(sock)
+        self.loop.unregister(sock)
+        self.loop.remove_ticker(self)
+        # paho重连时会丢弃缓冲区中没写完的数据
+        for handle in self.in_flight.values():
+            handle.finish(DROPPED)
+        self.in_flight.clear()
+        if self.sock is sock:
+            self.sock = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.set_writable, sock, True)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.set_writable, sock, False)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("已连接到MQTT代理")
+            self.backoff.reset()
+            self.connected = True
+            client.subscribe(self.report_topic)
+            if self.on_connected is not None:
+                self.on_connected()
+            self._drain()
+        else:
+            print(f"连接失败 错误码 {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if self.on_disconnected is not None:
+            self.on_disconnected(rc)
+        self._schedule_reconnect()
+
+    def _on_message(self, client, userdata, msg):
+        if self.on_payload is not None:
+            self.on_payload(msg.payload)
+
+    def _on_publish(self, client, userdata, mid):
+        handle = self.in_flight.pop(mid, None)
+        if handle is not None:
+            self.queue.sent(handle)
@@ -0,0 +1,84 @@
+"""无界面监视守护进程，不导入Qt"""
+import argparse
+import json
+import logging
+import signal
+import threading
+
+import mqtt_const
+import mqtt_state
+from mqtt_engine import create_engine, EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_STATE
+from mqtt_recorder import ReportRecorder
+
+LOGGER = logging.getLogger('mqtt_daemon')
+
+
+def load_config(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# 只有这些字段变化时才输出日志，wifi信号、风扇之类的变化忽略
+LOGGED_FIELDS = (mqtt_state.REMAINING_TIME | mqtt_state.CURR_LAYER | mqtt_state.TOTAL_LAYER |
+                 mqtt_state.NOZZLE_TEMPERATURE | mqtt_state.NOZZLE_TARGET_TEMPERATURE |
+                 mqtt_state.HOTBED_TEMPERATURE | mqtt_state.HOTBED_TARGET_TEMPERATURE |
+                 mqtt_state.TASK_PERCENT | mqtt_state.STAGE_CODE)
+
+
+def log_state(state: mqtt_state.PrinterState):
+    stage = mqtt_const.CURRENT_STAGE_IDS.get(state.stage_code, 'unknown')
+    LOGGER.info('%s %s%% layer %s/%s remaining %smin nozzle %s/%s bed %s/%s',
+                stage,
+                state.task_percent,
+                state.curr_layer,
+                state.total_layer,
+                state.remaining_time,
+                state.nozzle_temperature,
+                state.nozzle_target_temperature,
+                state.hotbed_temperature,
+                state.hotbed_target_temperature)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A1 Monitor headless daemon')
+    parser.add_argument('--config', default='config.json', help='连接配置文件，格式同GUI保存的config.json')
+    parser.add_argument('--record', metavar='PATH', help='把收到的原始报告录制到这个文件')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    config = load_config(args.config)
+    engine = create_engine(config)
+
+    def on_engine_event(event: str, data):
+        if event == EVENT_CONNECTED:
+            LOGGER.info('connected')
+        elif event == EVENT_DISCONNECTED:
+            LOGGER.info('disconnected rc=%s', data)
+        elif event == EVENT_STATE:
+            if data.mask & mqtt_state.STALE:
+                LOGGER.info('stale' if engine.state.stale else 'reports resumed')
+            if data.mask & LOGGED_FIELDS:
+                log_state(engine.state)
+
+    engine.add_listener(on_engine_event)
+
+    recorder = None
+    if args.record:
+        recorder = ReportRecorder(args.record)
+        recorder.start()
+        engine.add_listener(recorder.on_engine_event)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    engine.start()
+    stop_event.wait()
+    engine.stop()
+    if recorder is not None:
+        recorder.stop()
+
+
+if __name__ == "__main__":
+    main()
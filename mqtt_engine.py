@@ -0,0 +1,259 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import mqtt_commands
+import mqtt_json
+import mqtt_watchdog
+from mqtt_connection import MqttConnection
+from mqtt_filter import ReportFilter
+from mqtt_pending import PendingRequests
+from mqtt_queue import CommandQueue, COMMAND_PRIORITY, NORMAL, BULK
+from mqtt_resync import ResyncPolicy
+from mqtt_state import PrinterState
+from mqtt_watchdog import Watchdog
+
+EXPIRY_INTERVAL = 1  # 检查命令回复超时的间隔（秒）
+
+# 事件类型
+EVENT_CONNECTED = 'connected'
+EVENT_DISCONNECTED = 'disconnected'
+EVENT_REPORT = 'report'  # data: 原始报告 bytes
+EVENT_STATE = 'state'  # data: StateDelta，在网络线程解析生成，可直接跨线程传递
+
+
+class MonitorEngine:
+    """
+    无界面的监视核心：连接 + 状态模型 + 事件流
+    不依赖Qt，可以直接作为守护进程运行，MainWindow只是其中一个消费者
+    """
+
+    def __init__(self, connection, watchdog: Watchdog = None, resync: ResyncPolicy = None,
+                 pending: PendingRequests = None):
+        """
+        :param connection: 报告来源，MqttConnection或其他实现了相同接口的对象（如回放）
+        :param watchdog: 报告停止时的探测和重连策略，None表示使用默认值
+        :param resync: 何时请求完整状态，None表示使用默认值
+        :param pending: 等待回复的命令表，None表示使用默认超时
+        """
+        self.sn = connection.sn
+        self.state = PrinterState()
+        self.listeners = []
+        self.watchdog = watchdog or Watchdog()
+        self.resync = resync or ResyncPolicy()
+        self.pending = pending if pending is not None else PendingRequests()
+        self.reply_routes = set()  # 已经订阅了回复的(section, command)
+        self.routes_lock = threading.Lock()
+        self.expiry_lock = threading.Lock()
+        self.expiry_armed = False
+
+        # 状态模型只关心push_status，其余报告（命令回显、info、system）没人订阅时不解析
+        self.report_filter = ReportFilter()
+        self.report_filter.subscribe('print', 'push_status', self.on_print_status)
+        self.parsed_count = 0
+        self.dropped_count = 0
+
+        self.connection = connection
+        self.connection.on_connected = self.on_connected
+        self.connection.on_disconnected = self.on_disconnected
+        self.connection.on_payload = self.on_payload
+        self.connection.on_tick = self.on_tick  # 连接建立后约每秒调用一次，回放等来源不会调用
+
+    def add_listener(self, listener):
+        """
+        订阅事件流
+        :param listener: (event: str, data) -> None，在网络线程中调用
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def subscribe_reports(self, section: str, command, handler):
+        """
+        订阅解析后的报告
+        :param section: 顶层键名，如print、info、system
+        :param command: command字段的值，None表示该section下的所有报告
+        :param handler: (body: dict) -> None，在网络线程中调用
+        """
+        self.report_filter.subscribe(section, command, handler)
+
+    def unsubscribe_reports(self, section: str, command, handler):
+        self.report_filter.unsubscribe(section, command, handler)
+
+    def emit(self, event: str, data=None):
+        for listener in self.listeners:
+            try:
+                listener(event, data)
+            except Exception as e:
+                print('事件处理异常', event, e)
+
+    def start(self):
+        self.connection.start()
+
+    def stop(self):
+        self.connection.stop()
+
+    def on_connected(self):
+        now = time.monotonic()
+        self.watchdog.feed(now)
+        self.emit(EVENT_CONNECTED)
+        # 本地状态缺失或可能过期时才请求全部信息
+        self.resync.schedule(now)
+        self.check_resync(now)
+
+    def on_disconnected(self, rc: int):
+        self.pending.disconnected()
+        self.emit(EVENT_DISCONNECTED, rc)
+        self.set_stale(True)
+
+    def on_tick(self):
+        now = time.monotonic()
+        self.check_resync(now)
+        action = self.watchdog.check(now)
+        if action & mqtt_watchdog.STALE:
+            self.set_stale(True)
+        if action & mqtt_watchdog.RECONNECT:
+            print('长时间没有收到报告，重新连接', self.sn)
+            self.connection.reconnect()
+        elif action & mqtt_watchdog.PROBE:
+            self.publish_message(mqtt_commands.encoder(mqtt_commands.GET_VERSION).encode(), key='get_version',
+                                 priority=NORMAL)
+
+    def set_stale(self, stale: bool):
+        mask = self.state.set_stale(stale)
+        if mask:
+            if stale:
+                self.resync.invalidate()  # 这段时间的增量报告可能丢失
+            else:
+                self.resync.schedule(time.monotonic())
+            self.emit(EVENT_STATE, self.state.delta(mask))
+
+    def check_resync(self, now: float):
+        if self.resync.check(now):
+            self.publish_message(mqtt_commands.encoder(mqtt_commands.PUSH_ALL).encode(), key='pushall', priority=BULK)
+
+    def on_payload(self, payload: bytes):
+        self.watchdog.feed(time.monotonic())
+        if self.state.stale:
+            self.set_stale(False)
+        self.emit(EVENT_REPORT, payload)
+
+        # 先看顶层键名和command，没人关心的报告不做完整解析
+        if not self.report_filter.wants(payload):
+            self.dropped_count += 1
+            return
+
+        # 直接解析bytes，不再先解码成str
+        try:
+            report = mqtt_json.loads(payload)
+        except ValueError as e:
+            print('报告解析失败', e)
+            return
+        self.parsed_count += 1
+
+        if not isinstance(report, dict):
+            return
+        for section, body in report.items():
+            if not isinstance(body, dict):
+                continue
+            for handler in self.report_filter.match(section, body.get('command')):
+                try:
+                    handler(body)
+                except Exception as e:
+                    print('报告处理异常', section, e)
+
+    def on_print_status(self, data: dict):
+        if data.get('msg') == 0:
+            self.resync.on_full_report()  # msg为0的是完整报告，增量报告为1
+        mask = self.state.merge(data)
+        if mask:
+            self.emit(EVENT_STATE, self.state.delta(mask))
+
+    def publish_message(self, msg, key=None, priority: int = None):
+        """
+        发送命令，不等待发出
+        :param key: 合并用的键，发送队列采用COALESCE策略时同一key只保留最新的一条
+        :param priority: 发送队列的优先级通道，None表示按命令名判断，STOP/PAUSE/RESUME总是最先发出
+        :return: 连接返回的句柄，如MqttConnection的CommandHandle
+        """
+        return self.connection.publish(msg, key, priority)
+
+    def request(self, template: dict, param=None, timeout: float = None, priority: int = None,
+                callback=None) -> Future:
+        """
+        发送命令并等待打印机的回复，可以从任意线程调用
+        :param template: mqtt_commands中的命令，如mqtt_commands.PAUSE，不会被修改
+        :param param: 填入param字段的值，None表示使用模板中的值
+        :param timeout: 等待回复的时间（秒），None表示使用默认值
+        :param priority: 发送队列的优先级通道，None表示按命令名判断
+        :param callback: (future) -> None，收到回复、超时或失败时调用，回复时在网络线程中执行
+        :return: 结果为回复内容（section对应的对象）的Future，超时抛出CommandTimeout，发不出去抛出ConnectionError
+        """
+        encoder = mqtt_commands.encoder(template)
+        command = encoder.command
+        route = (encoder.section, command)
+        if route not in self.reply_routes:
+            with self.routes_lock:
+                if route not in self.reply_routes:
+                    # 回复默认没人订阅，会在解析前被过滤掉
+                    self.report_filter.subscribe(encoder.section, command, self.on_reply)
+                    self.reply_routes.add(route)
+
+        pending = self.pending.add(command, timeout)
+        self.arm_expiry()
+        if callback is not None:
+            pending.future.add_done_callback(callback)
+        if priority is None:
+            priority = COMMAND_PRIORITY.get(command, NORMAL)  # 已知命令名，不必让队列再解析一遍
+        msg = encoder.encode(pending.sequence_id, param)
+        self.pending.sent(pending, self.publish_message(msg, priority=priority))
+        return pending.future
+
+    def arm_expiry(self):
+        # 断线和重连期间on_tick不会被调用，超时检查用连接的定时器，只在有等待回复的命令时运行
+        with self.expiry_lock:
+            if self.expiry_armed:
+                return
+            self.expiry_armed = True
+        self.connection.call_later(EXPIRY_INTERVAL, self.on_expiry_timer)
+
+    def on_expiry_timer(self):
+        with self.expiry_lock:
+            self.expiry_armed = False
+        self.pending.expire(time.monotonic())
+        if self.pending:
+            self.arm_expiry()
+
+    def on_reply(self, body: dict):
+        self.pending.resolve(body)
+
+    def push_all_messages(self):
+        """
+        手动请求全部信息，不受自动请求的频率限制
+        """
+        self.resync.on_requested(time.monotonic())
+        return self.publish_message(mqtt_commands.encoder(mqtt_commands.PUSH_ALL).encode(), key='pushall',
+                                    priority=BULK)
+
+
+def create_engine(config: dict, loop=None) -> MonitorEngine:
+    """
+    按config.json的内容创建连接到打印机的引擎
+    可选项keepalive为MQTT keepalive（秒），watchdog为Watchdog的参数，如{"probe_after": 5, "reconnect_after": 15}，
+    resync为ResyncPolicy的参数，如{"min_interval": 30}，command_queue为CommandQueue的参数，如{"maxsize": 64, "policy": "drop"}，
+    command_timeout为request()默认等待回复的时间（秒）
+    :param loop: 共用的NetworkLoop，None表示连接自己创建一个
+    """
+    connection = MqttConnection(
+        username=config['username'],
+        lan_code=config['lan_code'],
+        sn=config['sn'],
+        ip=config['ip'],
+        port=config['port'],
+        loop=loop,
+        keepalive=config.get('keepalive', 60),
+        queue=CommandQueue(**config.get('command_queue', {})),
+    )
+    return MonitorEngine(connection, Watchdog(**config.get('watchdog', {})), ResyncPolicy(**config.get('resync', {})),
+                         PendingRequests(config.get('command_timeout', 10)))
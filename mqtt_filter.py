@@ -0,0 +1,68 @@
+import re
+
+# 报告形如 {"print": {..., "command": "push_status", ...}}，只看开头的键名和section对象第一层的command字段
+SECTION_PATTERN = re.compile(rb'\s*\{\s*"([^"]+)"\s*:\s*(\{)?')
+COMMAND_PATTERN = re.compile(rb'"command"\s*:\s*"([^"]*)"')
+NESTING_PATTERN = re.compile(rb'[{}\[\]]')
+
+
+def classify(payload: bytes) -> tuple:
+    """
+    不做完整解析，直接从原始报告里取出顶层键名和command
+    command之前出现过括号时不能确定它在section对象的第一层（可能属于嵌套对象），当作取不到，交给完整解析
+    :param payload: 原始报告
+    :return: (section, command)，取不到的部分为None
+    """
+    match = SECTION_PATTERN.match(payload)
+    if match is None:
+        return None, None
+    section = match.group(1).decode()
+    if match.group(2) is None:
+        return section, None  # section的值不是对象
+
+    start = match.end()
+    command = COMMAND_PATTERN.search(payload, start)
+    if command is None or NESTING_PATTERN.search(payload, start, command.start()) is not None:
+        return section, None
+    return section, command.group(1).decode()
+
+
+class ReportFilter:
+    """
+    按(section, command)登记报告处理函数
+    没有任何处理函数关心的报告在解析前就丢弃
+    """
+
+    def __init__(self):
+        self.handlers: dict = {}
+
+    def subscribe(self, section: str, command, handler):
+        """
+        :param section: 顶层键名，如print、info、system
+        :param command: command字段的值，None表示该section下的所有报告
+        :param handler: (body: dict) -> None，body为section对应的对象
+        """
+        self.handlers.setdefault((section, command), []).append(handler)
+
+    def unsubscribe(self, section: str, command, handler):
+        handlers = self.handlers.get((section, command))
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self.handlers[(section, command)]
+
+    def match(self, section: str, command) -> list:
+        handlers = self.handlers.get((section, None), [])
+        if command is not None:
+            handlers = self.handlers.get((section, command), []) + handlers
+        return handlers
+
+    def wants(self, payload: bytes) -> bool:
+        """
+        是否需要完整解析这条报告
+        无法识别的报告一律放行，交给完整解析判断
+        """
+        section, command = classify(payload)
+        if section is None or command is None:
+            return True
+        return bool(self.match(section, command))
@@ -0,0 +1,184 @@
+"""
+同时监视多台打印机，所有连接共用少量网络循环线程
+
+    python mqtt_fleet.py --config fleet.json
+    python mqtt_fleet.py --config fleet.json --loops 2 --summary-interval 30
+
+fleet.json是打印机配置的列表，每一项的格式与GUI保存的config.json相同
+"""
+import argparse
+import json
+import logging
+import signal
+import threading
+from collections import Counter
+from functools import partial
+
+import mqtt_const
+from mqtt_engine import MonitorEngine, create_engine, EVENT_CONNECTED, EVENT_DISCONNECTED
+from mqtt_loop import NetworkLoop
+from mqtt_queue import LANE_NAMES
+from mqtt_stats import LatencyStats
+
+LOGGER = logging.getLogger('mqtt_fleet')
+
+
+class FleetManager:
+    """
+    多台打印机的管理器：每台打印机有自己的MonitorEngine和状态模型，
+    连接按轮询分配到固定数量的NetworkLoop上，所有事件汇总到同一个分发入口
+    """
+
+    def __init__(self, loops: int = 1, connect_workers: int = 4, pushall_rate: float = 20):
+        """
+        :param loops: 网络循环线程数
+        :param connect_workers: 每个循环建立连接用的线程数
+        :param pushall_rate: 整个打印机群平均每秒最多自动请求多少次完整状态，重连后的请求按此分散到一段时间内
+        """
+        self.pushall_rate = pushall_rate
+        self.loops = [NetworkLoop(name=f'mqtt-fleet-{i}', connect_workers=connect_workers) for i in range(loops)]
+        self.engines = {}  # sn -> MonitorEngine
+        self.listeners = []
+        self.running = False
+        self.next_loop = 0
+
+    def add_listener(self, listener):
+        """
+        订阅所有打印机的事件
+        :param listener: (sn: str, event: str, data) -> None，在网络循环线程中调用
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def dispatch(self, sn: str, event: str, data):
+        for listener in self.listeners:
+            try:
+                listener(sn, event, data)
+            except Exception as e:
+                print('事件处理异常', sn, event, e)
+
+    def add_printer(self, config: dict) -> MonitorEngine:
+        """
+        :param config: 格式与config.json相同
+        """
+        if config['sn'] in self.engines:
+            raise ValueError(f"printer {config['sn']} already added")
+
+        loop = self.loops[self.next_loop]
+        self.next_loop = (self.next_loop + 1) % len(self.loops)
+
+        engine = create_engine(config, loop)
+        engine.add_listener(partial(self.dispatch, engine.sn))
+        self.engines[engine.sn] = engine
+
+        # 打印机越多，重连后请求完整状态的时间分散得越开
+        spread = len(self.engines) / self.pushall_rate
+        for each in self.engines.values():
+            each.resync.spread = max(each.resync.spread, spread)
+        if self.running:
+            engine.start()
+        return engine
+
+    def remove_printer(self, sn: str):
+        engine = self.engines.pop(sn)
+        if self.running:
+            engine.stop()
+
+    def queue_latency(self) -> dict:
+        """
+        所有打印机发送队列的排队时间，按优先级通道合并
+        :return: 通道名 -> LatencyStats
+        """
+        merged = {name: LatencyStats() for name in LANE_NAMES}
+        for engine in self.engines.values():
+            for name, stats in zip(LANE_NAMES, engine.connection.queue.latency):
+                merged[name].merge(stats)
+        return merged
+
+    def command_rtt(self) -> dict:
+        """
+        所有打印机的命令往返时间，按命令名合并
+        :return: command -> LatencyStats
+        """
+        merged = {}
+        for engine in self.engines.values():
+            for command, stats in list(engine.pending.rtt.items()):
+                merged.setdefault(command, LatencyStats()).merge(stats)
+        return merged
+
+    def start(self):
+        self.running = True
+        for loop in self.loops:
+            loop.start()
+        for engine in self.engines.values():
+            engine.start()
+
+    def stop(self):
+        self.running = False
+        # 断开请求先投递到各循环，循环停止前会处理完
+        for engine in self.engines.values():
+            engine.stop()
+        for loop in self.loops:
+            loop.stop()
+
+
+def load_fleet_config(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def log_summary(states: dict, connected: set):
+    """
+    :param states: sn -> PrinterState
+    """
+    stages = Counter(mqtt_const.CURRENT_STAGE_IDS.get(state.stage_code, 'unknown') for state in states.values())
+    stale = sum(state.stale for state in states.values())
+    LOGGER.info('%d/%d connected, %d stale, %s', len(connected), len(states), stale,
+                ', '.join(f'{stage} {count}' for stage, count in stages.most_common()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A1 Monitor fleet daemon')
+    parser.add_argument('--config', default='fleet.json', help='打印机配置列表')
+    parser.add_argument('--loops', type=int, default=1, help='网络循环线程数')
+    parser.add_argument('--summary-interval', type=float, default=60, help='汇总日志的间隔（秒）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    fleet = FleetManager(loops=args.loops)
+    for config in load_fleet_config(args.config):
+        fleet.add_printer(config)
+
+    connected = set()
+
+    def on_fleet_event(sn: str, event: str, data):
+        if event == EVENT_CONNECTED:
+            connected.add(sn)
+        elif event == EVENT_DISCONNECTED:
+            connected.discard(sn)
+            LOGGER.info('%s disconnected rc=%s', sn, data)
+
+    fleet.add_listener(on_fleet_event)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    fleet.start()
+    while not stop_event.wait(args.summary_interval):
+        log_summary({sn: engine.state for sn, engine in fleet.engines.items()}, connected)
+        for name, stats in fleet.queue_latency().items():
+            if stats.count:
+                LOGGER.info('queue %s: %d sent, p50 %.1fms, p99 %.1fms, max %.1fms', name, stats.count,
+                            stats.percentile(50) * 1000, stats.percentile(99) * 1000, stats.max * 1000)
+        for command, stats in sorted(fleet.command_rtt().items()):
+            LOGGER.info('rtt %s: %d replies, p50 %.1fms, p99 %.1fms, max %.1fms', command, stats.count,
+                        stats.percentile(50) * 1000, stats.percentile(99) * 1000, stats.max * 1000)
+    fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
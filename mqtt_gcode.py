@@ -0,0 +1,218 @@
+"""
+把G-code文件分批通过gcode_line命令发送给打印机，按回复控制流量
+
+    python mqtt_gcode.py --config config.json part.gcode
+    python mqtt_gcode.py --config config.json part.gcode --batch-bytes 8192 --window 8
+
+文件边读边发，同时在途的只有window批，内存占用与文件大小无关
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import mqtt_commands
+from mqtt_engine import MonitorEngine, create_engine
+from mqtt_queue import BULK
+
+LOGGER = logging.getLogger('mqtt_gcode')
+
+
+def iter_batches(lines, batch_bytes: int, strip_comments: bool = True):
+    """
+    把G-code行打包成不超过batch_bytes个字符的批次，批内各行以\\n分隔
+    单独一行就超过batch_bytes时自成一批
+    :param lines: 可迭代的文本行，如打开的文件
+    :return: 生成(批次文本, 行数)
+    """
+    batch = []
+    size = 0
+    for line in lines:
+        if strip_comments:
+            line = line.split(';', 1)[0]
+        line = line.strip()
+        if not line:
+            continue
+        if batch and size + 1 + len(line) > batch_bytes:
+            yield '\n'.join(batch), len(batch)
+            batch = []
+            size = 0
+        size += len(line) + (1 if batch else 0)
+        batch.append(line)
+    if batch:
+        yield '\n'.join(batch), len(batch)
+
+
+class GcodeStreamer:
+    """
+    G-code流式发送：每批作为一条gcode_line命令，最多window批已发出但还没收到回复
+    收到回复才发下一批；任何一批失败、超时或连接断开都会停止发送，G-code不能跳过中间的行
+    """
+
+    def __init__(self, engine: MonitorEngine, path: str, batch_bytes: int = 4096, window: int = 4,
+                 timeout: float = 30, strip_comments: bool = True):
+        """
+        :param engine: 已经启动或即将启动的引擎，未连接时命令在发送队列中等待
+        :param batch_bytes: 每批最多多少个字符
+        :param window: 最多同时有多少批在等待回复
+        :param timeout: 每批等待回复的时间（秒）
+        :param strip_comments: 是否去掉;之后的注释
+        """
+        self.engine = engine
+        self.path = path
+        self.batch_bytes = batch_bytes
+        self.window = window
+        self.timeout = timeout
+        self.strip_comments = strip_comments
+
+        self.file = None
+        self.batches = None
+        self.total_bytes = os.path.getsize(path)
+
+        self.lock = threading.Lock()  # 保护下面的计数，回复在网络线程中处理
+        self.in_flight = 0
+        self.eof = False
+        self.cancelled = False
+        self.error = None  # 停止发送的原因
+        self.lines_sent = 0
+        self.lines_acked = 0
+        self.batches_acked = 0
+        self.started_at = None
+        self.read_fraction = 0.0  # 结束时已读取的比例
+        self.finished = threading.Event()
+
+        # 保证同一时刻只有一个线程在读文件和发送，回复回调可能与调用线程同时到达
+        self.pump_lock = threading.Lock()
+        self.wake = False
+
+    def start(self):
+        self.file = open(self.path, 'r', encoding='utf-8', errors='replace')
+        self.batches = iter_batches(self.file, self.batch_bytes, self.strip_comments)
+        self.started_at = time.monotonic()
+        self._pump()
+
+    def cancel(self):
+        """
+        不再发送新的批次，已经发出的批次无法撤回
+        """
+        with self.lock:
+            self.cancelled = True
+        self._pump()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        :return: 是否已经结束（全部完成、失败或取消），结果看error
+        """
+        return self.finished.wait(timeout)
+
+    @property
+    def progress(self) -> float:
+        """
+        :return: 已读取的文件比例，0~1
+        """
+        if self.file is None or not self.total_bytes:
+            return 0
+        if self.file.closed:
+            return self.read_fraction
+        return min(1.0, self.file.buffer.tell() / self.total_bytes)
+
+    def _pump(self):
+        # 拿不到锁说明别的线程（或本线程外层）正在发送，由它在结束前再检查一次
+        self.wake = True
+        while self.wake and self.pump_lock.acquire(blocking=False):
+            try:
+                self.wake = False
+                self._fill()
+            finally:
+                self.pump_lock.release()
+
+    def _fill(self):
+        while True:
+            with self.lock:
+                if self.cancelled or self.error is not None or self.eof or self.in_flight >= self.window:
+                    stop = True
+                else:
+                    stop = False
+                    self.in_flight += 1
+                if stop:
+                    if (self.in_flight == 0 and (self.eof or self.cancelled)) or self.error is not None:
+                        self._finish()
+                    return
+
+            batch = next(self.batches, None)
+            if batch is None:
+                with self.lock:
+                    self.eof = True
+                    self.in_flight -= 1
+                continue
+
+            param, lines = batch
+            with self.lock:
+                self.lines_sent += lines
+            self.engine.request(mqtt_commands.SEND_GCODE_TEMPLATE, param, self.timeout, BULK,
+                                callback=lambda future, lines=lines: self._on_reply(future, lines))
+
+    def _on_reply(self, future, lines: int):
+        try:
+            reply = future.result()
+            error = None if reply.get('result', 'success') == 'success' else \
+                RuntimeError(f"gcode_line failed: {reply.get('reason')}")
+        except Exception as e:
+            error = e
+        with self.lock:
+            self.in_flight -= 1
+            if error is None:
+                self.batches_acked += 1
+                self.lines_acked += lines
+            elif self.error is None:
+                self.error = error
+        self._pump()
+
+    def _finish(self):
+        if self.finished.is_set():
+            return
+        if self.file is not None:
+            self.read_fraction = 1.0 if self.eof else min(1.0, self.file.buffer.tell() / (self.total_bytes or 1))
+            self.file.close()
+        if self.error is None and self.cancelled and not self.eof:
+            self.error = RuntimeError('cancelled')
+        self.finished.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream a G-code file to the printer')
+    parser.add_argument('gcode', help='G-code文件')
+    parser.add_argument('--config', default='config.json', help='打印机配置，格式与GUI保存的config.json相同')
+    parser.add_argument('--batch-bytes', type=int, default=4096, help='每条命令最多多少个字符')
+    parser.add_argument('--window', type=int, default=4, help='最多同时等待多少条回复')
+    parser.add_argument('--timeout', type=float, default=30, help='每条命令等待回复的时间（秒）')
+    parser.add_argument('--keep-comments', action='store_true', help='不去掉注释')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        engine = create_engine(json.load(f))
+    streamer = GcodeStreamer(engine, args.gcode, args.batch_bytes, args.window, args.timeout,
+                             not args.keep_comments)
+    engine.start()
+    streamer.start()
+    try:
+        while not streamer.wait(5):
+            LOGGER.info('%.1f%% %d lines acked', streamer.progress * 100, streamer.lines_acked)
+    except KeyboardInterrupt:
+        streamer.cancel()
+        streamer.wait()
+
+    elapsed = time.monotonic() - streamer.started_at
+    if streamer.error is not None:
+        LOGGER.info('stopped after %d lines: %s', streamer.lines_acked, streamer.error)
+    else:
+        LOGGER.info('%d lines in %d batches, %.1fs', streamer.lines_acked, streamer.batches_acked, elapsed)
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
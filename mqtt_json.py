@@ -0,0 +1,56 @@
+"""
+报告解析用的JSON后端
+装了orjson或ujson时优先使用，否则退回标准库json
+可以用环境变量 A1_MONITOR_JSON=orjson|ujson|json 指定
+"""
+import json
+import os
+
+
+def _load_orjson():
+    import orjson
+    # orjson直接接受bytes
+    return orjson.loads
+
+
+def _load_ujson():
+    import ujson
+    return ujson.loads
+
+
+def _load_json():
+    # json.loads本身就接受bytes，会自行识别编码
+    return json.loads
+
+
+BACKENDS = {
+    'orjson': _load_orjson,
+    'ujson': _load_ujson,
+    'json': _load_json,
+}
+
+
+def get_backend(name: str):
+    """
+    加载指定的后端
+    :param name: orjson / ujson / json
+    :return: loads，接受bytes；解析失败均抛出ValueError的子类
+    """
+    return BACKENDS[name]()
+
+
+def _select_backend() -> tuple:
+    names = list(BACKENDS)
+    preferred = os.environ.get('A1_MONITOR_JSON')
+    if preferred in BACKENDS:
+        names.remove(preferred)
+        names.insert(0, preferred)
+
+    for name in names:
+        try:
+            return name, get_backend(name)
+        except ImportError:
+            continue
+
+
+BACKEND, loads = _select_backend()
@@ -0,0 +1,251 @@
+import heapq
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+
+class TimerHandle:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class NetworkLoop:
+    """
+    单线程的网络事件循环，用selector同时等待多个连接的socket
+    只在socket可读写、定时器到期或其他线程投递调用时唤醒
+    """
+
+    def __init__(self, name: str = 'mqtt-loop', connect_workers: int = 4, tick_interval: float = 1):
+        """
+        :param connect_workers: 建立连接（TCP + TLS握手是阻塞的）用的线程数，0表示直接在循环线程里连接
+        :param tick_interval: 调用各连接tick()的间隔（秒），用于keepalive等周期性检查
+        """
+        self.name = name
+        self.tick_interval = tick_interval
+        self.connect_workers = connect_workers
+
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+
+        self.lock = threading.Lock()
+        self.calls = deque()
+        self.timers = []
+        self.timer_sequence = itertools.count()
+        self.tickers = set()
+        self.tick_handle = None
+
+        self.jobs = None
+        self.workers = []
+
+        self.thread = None
+        self.running = False
+
+    def in_loop_thread(self) -> bool:
+        return self.thread is threading.current_thread()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+        # 连接线程设为daemon：握手卡住时stop()和进程退出都不必等它，ThreadPoolExecutor的线程在退出时会被join
+        self.jobs = queue.SimpleQueue()
+        self.workers = [threading.Thread(target=self._run_jobs, args=(self.jobs,), name=f'{self.name}-connect-{i}',
+                                         daemon=True)
+                        for i in range(self.connect_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """
+        停止循环，已投递的调用会先执行完；正在进行的连接不等待，完成后的回调不再执行
+        """
+        self.call_soon(self._stop)
+        if self.thread is not None and not self.in_loop_thread():
+            self.thread.join()
+        for _ in self.workers:
+            self.jobs.put(None)
+
+    def _stop(self):
+        self.running = False
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # 缓冲区已满说明已经有待处理的唤醒
+
+    def call_soon(self, callback, *args):
+        """
+        在循环线程中执行callback，可以从任意线程调用
+        """
+        with self.lock:
+            self.calls.append((callback, args))
+        if not self.in_loop_thread():
+            self.wake()
+
+    def call_later(self, delay: float, callback, *args) -> TimerHandle:
+        """
+        delay秒后在循环线程中执行callback，可以从任意线程调用
+        """
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        with self.lock:
+            heapq.heappush(self.timers, (handle.deadline, next(self.timer_sequence), handle))
+        if not self.in_loop_thread():
+            self.wake()
+        return handle
+
+    def run_in_executor(self, func, callback):
+        """
+        在连接线程中执行阻塞的func，完成后在循环线程中调用callback(result, error)
+        """
+        if not self.connect_workers:
+            try:
+                callback(func(), None)
+            except Exception as e:
+                callback(None, e)
+            return
+        self.jobs.put((func, callback))
+
+    def _run_jobs(self, jobs: queue.SimpleQueue):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            func, callback = job
+            try:
+                result, error = func(), None
+            except Exception as e:
+                result, error = None, e
+            if self.running:
+                self.call_soon(callback, result, error)
+
+    def register(self, sock, handler, writable: bool = False):
+        """
+        开始监听socket，handler需要实现on_readable()和on_writable()，只能在循环线程中调用
+        """
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writable else 0)
+        self.selector.register(sock, events, handler)
+
+    def set_writable(self, sock, writable: bool):
+        try:
+            key = self.selector.get_key(sock)
+        except (KeyError, ValueError):
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writable else 0)
+        if key.events != events:
+            self.selector.modify(sock, events, key.data)
+
+    def unregister(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def add_ticker(self, ticker):
+        """
+        ticker.tick()会每隔tick_interval秒被调用一次，所有ticker共用一个定时器
+        """
+        self.tickers.add(ticker)
+        if self.tick_handle is None:
+            self.tick_handle = self.call_later(self.tick_interval, self._tick)
+
+    def remove_ticker(self, ticker):
+        self.tickers.discard(ticker)
+
+    def _tick(self):
+        for ticker in list(self.tickers):
+            try:
+                ticker.tick()
+            except Exception as e:
+                print('定时处理异常', e)
+        if self.tickers:
+            self.tick_handle = self.call_later(self.tick_interval, self._tick)
+        else:
+            self.tick_handle = None
+
+    def run(self):
+        while self.running:
+            self._run_calls()
+            timeout = self._run_timers()
+            if not self.running:
+                break
+
+            for key, events in self.selector.select(timeout):
+                handler = key.data
+                if handler is None:
+                    self._drain_wake()
+                    continue
+                try:
+                    if events & selectors.EVENT_READ:
+                        handler.on_readable()
+                    if events & selectors.EVENT_WRITE:
+                        handler.on_writable()
+                except Exception as e:
+                    print('网络事件处理异常', e)
+
+        self._run_calls()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+    def _drain_wake(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run_calls(self):
+        with self.lock:
+            calls = self.calls
+            self.calls = deque()
+        for callback, args in calls:
+            try:
+                callback(*args)
+            except Exception as e:
+                print('调用处理异常', callback, e)
+
+    def _run_timers(self):
+        """
+        执行到期的定时器
+        :return: 距下一个定时器的时间，没有定时器时为None
+        """
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.timers and self.timers[0][0] <= now:
+                due.append(heapq.heappop(self.timers)[2])
+            next_deadline = self.timers[0][0] if self.timers else None
+
+        for handle in due:
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                print('定时处理异常', handle.callback, e)
+
+        # 定时器回调可能投递了新的调用，此时不等待
+        if self.calls:
+            return 0
+        if next_deadline is None:
+            with self.lock:
+                next_deadline = self.timers[0][0] if self.timers else None
+            if next_deadline is None:
+                return None
+        return max(0.0, next_deadline - time.monotonic())
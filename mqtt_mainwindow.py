@@ -1,14 +1,43 @@
 import json
 import locale
+import math
 import sys
 import time
 
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtWidgets import QApplication, QMainWindow, QDialog, QLabel, QLineEdit, QSpinBox, QVBoxLayout, QHBoxLayout, QDialogButtonBox
 
 import mqtt_const
+import mqtt_state
 from ui.ui_mqtt_mainwindow import Ui_MainWindow
+from mqtt_engine import MonitorEngine, create_engine
 from mqtt_worker import MqttWorker
+from mqtt_recorder import ReportRecorder
+from mqtt_state import PrinterState, StateDelta
+
+# 界面上显示的字段，其余字段（如wifi信号、风扇）变化时不刷新
+DISPLAY_FIELDS = (mqtt_state.TASK_NAME | mqtt_state.REMAINING_TIME | mqtt_state.CURR_LAYER | mqtt_state.TOTAL_LAYER |
+                  mqtt_state.NOZZLE_TEMPERATURE | mqtt_state.NOZZLE_TARGET_TEMPERATURE |
+                  mqtt_state.HOTBED_TEMPERATURE | mqtt_state.HOTBED_TARGET_TEMPERATURE |
+                  mqtt_state.TASK_PERCENT | mqtt_state.STAGE_CODE | mqtt_state.STALE)
+
+# 默认最大刷新帧率，可在config.json中用max_fps覆盖
+DEFAULT_MAX_FPS = 10
+
+
+def frame_interval(max_fps) -> float:
+    """
+    :param max_fps: 配置中的最大刷新帧率，不是正数时使用DEFAULT_MAX_FPS
+    :return: 两帧之间的最短间隔（秒）
+    """
+    try:
+        max_fps = float(max_fps)
+    except (TypeError, ValueError):
+        max_fps = 0
+    if not 0 < max_fps < math.inf:
+        print('max_fps配置无效，使用默认值', DEFAULT_MAX_FPS)
+        max_fps = DEFAULT_MAX_FPS
+    return 1 / max_fps
 
 
 class ConfigDialog(QDialog):
@@ -79,56 +108,66 @@ class ConfigDialog(QDialog):
         self.setLayout(layout)
 
     def get_config(self):
-        return {
+        # 保留对话框里没有的配置项（如max_fps）
+        config = dict(self.config)
+        config.update({
             "username": self.username_edit.text(),
             "lan_code": self.lan_code_edit.text(),
             "sn": self.sn_edit.text(),
             "ip": self.ip_edit.text(),
             "port": self.port_edit.value()
-        }
+        })
+        return config
 
 
 class MainWindow(Ui_MainWindow, QMainWindow):
-    def __init__(self):
+    def __init__(self, engine: MonitorEngine = None, config: dict = None):
+        """
+        :param engine: 使用指定的引擎（如回放），为None时弹出配置对话框连接打印机
+        :param config: 使用指定引擎时的配置，如max_fps
+        """
         super(MainWindow, self).__init__()
 
-        # 显示配置对话框
-        config_dialog = ConfigDialog()
-        if config_dialog.exec() == QDialog.DialogCode.Accepted:
-            self.mqtt_connect_info = config_dialog.get_config()
-            self.save_config()
+        if engine is None:
+            # 显示配置对话框
+            config_dialog = ConfigDialog()
+            if config_dialog.exec() == QDialog.DialogCode.Accepted:
+                self.mqtt_connect_info = config_dialog.get_config()
+                self.save_config()
+            else:
+                sys.exit()
+
+            # 读取mqtt连接信息
+            engine = create_engine(self.mqtt_connect_info)
         else:
-            sys.exit()
+            self.mqtt_connect_info = config or {}
 
         self.translations: dict = {}
 
         self.data_init()
 
-        # 读取mqtt连接信息
+        self.mqtt_worker = MqttWorker(engine)
+        self.mqtt_worker.state_changed.connect(self.schedule_render)
 
-        self.mqtt_worker = MqttWorker(
-            username=self.mqtt_connect_info['username'],
-            lan_code=self.mqtt_connect_info['lan_code'],
-            sn=self.mqtt_connect_info['sn'],
-            ip=self.mqtt_connect_info['ip'],
-            port=self.mqtt_connect_info['port'],
-        )
-        self.mqtt_worker.message_received.connect(self.update_monitor_info)
+        # 配置了record_path时录制原始报告，用于复现问题和基准测试
+        self.recorder = None
+        if self.mqtt_connect_info.get('record_path'):
+            self.recorder = ReportRecorder(self.mqtt_connect_info['record_path'])
+            self.recorder.start()
+            self.mqtt_worker.engine.add_listener(self.recorder.on_engine_event)
+
+        # 限制刷新帧率，两帧之间到达的增量在网络线程合并，只显示最新状态
+        self.frame_interval = frame_interval(self.mqtt_connect_info.get('max_fps', DEFAULT_MAX_FPS))
+        self.last_render_time: float = 0
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.render_pending)
 
         self.setupUi(self)
         self.btn_pull_all.clicked.connect(self.btn_pull_all_on_clicked)
 
-        self.task_name: str = '未知任务'
-        self.total_layer: int = -1
-        self.curr_layer: int = -1
-        self.total_time: int = -1
-        self.remind_time = -1
-        self.nozzle_temperature: float = -1
-        self.nozzle_target_temperature: float = -1
-        self.hotbed_temperature: float = -1
-        self.hotbed_target_temperature: float = -1
-        self.task_percent: int = -1
-        self.stage_code: int = -1
+        self.state = PrinterState()
+        self.label_texts: dict = {}  # 各标签当前显示的文本
 
         self.ui_init()
         self.clear_info()
@@ -150,40 +189,90 @@ class MainWindow(Ui_MainWindow, QMainWindow):
         self.setWindowTitle('A1 Monitor')
         self.show_monitor_info()
 
-    def show_monitor_info(self):
-        self.label_task.setText(f'任务: {self.task_name}')
-        self.label_layer.setText(f'层数: {self.curr_layer} / {self.total_layer}')
+    def set_label_text(self, label: QLabel, text: str):
+        # 文本没变就不调用setText，避免多余的布局和重绘
+        if self.label_texts.get(label) != text:
+            self.label_texts[label] = text
+            label.setText(text)
+
+    def set_progress(self, value: int):
+        if self.progressBar.value() != value:
+            self.progressBar.setValue(value)
+
+    def show_monitor_info(self, mask: int = DISPLAY_FIELDS):
+        """
+        刷新界面
+        :param mask: 发生变化的字段，只刷新依赖这些字段的控件
+        """
+        state = self.state
+
+        # 状态切换（如空闲→打印）时其他控件也要重新显示
+        if mask & mqtt_state.STAGE_CODE:
+            mask = DISPLAY_FIELDS
+
+        if mask & mqtt_state.STALE:
+            # 连接失效时在标题上提示，显示的数据可能已经过期
+            self.setWindowTitle('A1 Monitor (无响应)' if state.stale else 'A1 Monitor')
+
+        if mqtt_const.CURRENT_STAGE_IDS.get(state.stage_code) == 'idle':
+            self.clear_info()
+            return
+
+        if mask & mqtt_state.TASK_NAME:
+            self.set_label_text(self.label_task, f'任务: {state.task_name or "未知任务"}')
+
+        if mask & (mqtt_state.CURR_LAYER | mqtt_state.TOTAL_LAYER):
+            self.set_label_text(self.label_layer, f'层数: {state.curr_layer} / {state.total_layer}')
+
+        if mask & mqtt_state.REMAINING_TIME:
+            self.show_remaining_time()
+
+        if mask & (mqtt_state.NOZZLE_TEMPERATURE | mqtt_state.NOZZLE_TARGET_TEMPERATURE):
+            self.set_label_text(self.label_nozzle,
+                                f'喷嘴: {state.nozzle_temperature:.2f} / {state.nozzle_target_temperature:.2f}')
+
+        if mask & (mqtt_state.HOTBED_TEMPERATURE | mqtt_state.HOTBED_TARGET_TEMPERATURE):
+            self.set_label_text(self.label_hotbed,
+                                f'热床: {state.hotbed_temperature:.2f} / {state.hotbed_target_temperature:.2f}')
+
+        if mask & mqtt_state.TASK_PERCENT:
+            self.set_progress(state.task_percent)
+
+        if mask & mqtt_state.STAGE_CODE:
+            self.show_current_stage()
+
+    def show_remaining_time(self):
+        remaining_time = self.state.remaining_time
         # 天数
-        days = self.remind_time // 1440
+        days = remaining_time // 1440
         # 小时数
-        hours = self.remind_time % 1440 // 60
+        hours = remaining_time % 1440 // 60
         # 钟数
-        minutes = self.remind_time % 1440 % 60
+        minutes = remaining_time % 1440 % 60
 
         # 计算完成时间
-        finish_time = time.time() + self.remind_time * 60
+        finish_time = time.time() + remaining_time * 60
         finish_time_struct = time.localtime(finish_time)
         finish_time_str = time.strftime('%I:%M %p', finish_time_struct)
 
         if days > 0:
-            self.label_time.setText(f'剩余: {days}天{hours:02d}时{minutes:02d}分 → 明天{finish_time_str}')
+            self.set_label_text(self.label_time, f'剩余: {days}天{hours:02d}时{minutes:02d}分 → 明天{finish_time_str}')
         elif hours > 0:
-            self.label_time.setText(f'剩余: {hours}时{minutes:02d}分 → {finish_time_str}')
+            self.set_label_text(self.label_time, f'剩余: {hours}时{minutes:02d}分 → {finish_time_str}')
         else:
-            self.label_time.setText(f'剩余: {minutes}分 → {finish_time_str}')
-        self.label_nozzle.setText(f'喷嘴: {self.nozzle_temperature:.2f} / {self.nozzle_target_temperature:.2f}')
-        self.label_hotbed.setText(f'热床: {self.hotbed_temperature:.2f} / {self.hotbed_target_temperature:.2f}')
-        self.progressBar.setValue(self.task_percent)
-        self.show_current_stage()
+            self.set_label_text(self.label_time, f'剩余: {minutes}分 → {finish_time_str}')
 
     def clear_info(self):
-        self.label_task.setText('任务: 无')
-        self.label_layer.setText('层数: ')
-        self.label_time.setText('剩余: ')
-        self.label_nozzle.setText(f'喷嘴: {self.nozzle_temperature:.2f} / {self.nozzle_target_temperature:.2f}')
-        self.label_hotbed.setText(f'热床: {self.hotbed_temperature:.2f} / {self.hotbed_target_temperature:.2f}')
-        self.label_stage.setText('状态: 空闲')
-        self.progressBar.setValue(0)
+        state = self.state
+        self.set_label_text(self.label_task, '任务: 无')
+        self.set_label_text(self.label_layer, '层数: ')
+        self.set_label_text(self.label_time, '剩余: ')
+        self.set_label_text(self.label_nozzle,
+                            f'喷嘴: {state.nozzle_temperature:.2f} / {state.nozzle_target_temperature:.2f}')
+        self.set_label_text(self.label_hotbed,
+                            f'热床: {state.hotbed_temperature:.2f} / {state.hotbed_target_temperature:.2f}')
+        self.set_label_text(self.label_stage, '状态: 空闲')
+        self.set_progress(0)
 
     def load_config(self):
         with open('config.json', 'r', encoding='utf-8') as f:
@@ -194,79 +283,44 @@ class MainWindow(Ui_MainWindow, QMainWindow):
             json.dump(self.mqtt_connect_info, f, indent=4)
 
     def show_current_stage(self):
-        current_stage = mqtt_const.CURRENT_STAGE_IDS.get(self.stage_code, f'未知状态{self.stage_code}')
+        stage_code = self.state.stage_code
+        current_stage = mqtt_const.CURRENT_STAGE_IDS.get(stage_code, f'未知状态{stage_code}')
         if current_stage == 'idle':
             self.clear_info()
         else:
             current_stage = self.translations['entity']['sensor']['stage']['state'].get(current_stage, current_stage)
-            self.label_stage.setText(f'状态: {current_stage}')
-
-    def update_monitor_info(self, message: str):
-        try:
-            data = json.loads(message)['print']
-
-            for key, value in data.items():
-                if key == 'subtask_name':
-                    self.task_name = value
-                    continue
-
-                if key == 'mc_remaining_time':
-                    self.remind_time = value
-                    continue
-
-                if key == 'nozzle_temper':
-                    self.nozzle_temperature = value
-                    continue
-
-                if key == 'bed_temper':
-                    self.hotbed_temperature = value
-                    continue
+            self.set_label_text(self.label_stage, f'状态: {current_stage}')
 
-                if key == 'mc_percent':
-                    self.task_percent = value
-                    continue
+    def schedule_render(self):
+        if self.render_timer.isActive():
+            return
+        delay = self.last_render_time + self.frame_interval - time.monotonic()
+        self.render_timer.start(max(0, int(delay * 1000)))
 
-                if key == 'layer_num':
-                    self.curr_layer = value
-                    continue
+    def render_pending(self):
+        self.last_render_time = time.monotonic()
+        delta = self.mqtt_worker.take_delta()
+        if delta:
+            self.update_monitor_info(delta)
 
-                if key == 'total_layer_num':
-                    self.total_layer = value
-                    continue
-
-                if key == 'bed_target_temper':
-                    self.hotbed_target_temperature = value
-                    continue
-
-                if key == 'nozzle_target_temper':
-                    self.nozzle_target_temperature = value
-                    continue
-
-                if key == 'stg_cur':
-                    self.stage_code = value
-                    # self.show_current_stage(value)
-                    continue
-
-                continue
-
-                # # 调试用 跳过特定信息
-                # if key in ['msg', 'sequence_id', 'wifi_signal', 'command', 'mc_print_line_number',
-                #            'heatbreak_fan_speed']:
-                #     continue
-                #
-                # print(key, value)
-
-            self.show_monitor_info()
+    def update_monitor_info(self, delta: StateDelta):
+        try:
+            # 只刷新显示相关且发生变化的字段
+            mask = self.state.apply(delta) & DISPLAY_FIELDS
+            if mask:
+                self.show_monitor_info(mask)
 
         except Exception as e:
             print('发生异常', e)
-            print(message)
+            print(delta.values)
 
     def btn_pull_all_on_clicked(self):
         self.mqtt_worker.push_all_messages()
 
     def closeEvent(self, event):
         self.mqtt_worker.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
         super().closeEvent(event)
 
 
@@ -0,0 +1,138 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from mqtt_queue import DROPPED, QUEUED
+from mqtt_stats import LatencyStats
+
+
+class CommandTimeout(Exception):
+    """
+    超时没有收到打印机的回复
+    """
+
+
+class PendingRequest:
+    __slots__ = ('sequence_id', 'command', 'future', 'handle', 'created_at', 'deadline')
+
+    def __init__(self, sequence_id: str, command: str, timeout: float):
+        self.sequence_id = sequence_id
+        self.command = command
+        self.future = Future()
+        self.handle = None  # 连接返回的句柄，发出时间从这里取
+        self.created_at = time.monotonic()
+        self.deadline = self.created_at + timeout
+
+
+class PendingRequests:
+    """
+    按sequence_id把打印机的回复对应到发出的命令
+    每个连接一个，sequence_id在连接的生命周期内单调递增，重连后也不重复
+    打印机主动推送的push_status使用自己的sequence_id，不参与匹配
+    """
+
+    def __init__(self, timeout: float = 10):
+        """
+        :param timeout: 默认等待回复的时间（秒）
+        """
+        self.timeout = timeout
+        self.counter = itertools.count(1)
+        self.pending = {}  # sequence_id -> PendingRequest
+        self.lock = threading.Lock()
+        self.rtt = {}  # command -> LatencyStats，从写入socket到收到回复，只在网络线程中更新
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, command: str, timeout: float = None) -> PendingRequest:
+        """
+        分配sequence_id并登记，可以从任意线程调用
+        """
+        request = PendingRequest(str(next(self.counter)), command, timeout if timeout is not None else self.timeout)
+        with self.lock:
+            self.pending[request.sequence_id] = request
+        return request
+
+    def sent(self, request: PendingRequest, handle):
+        """
+        命令交给连接后调用，没能入队（或paho直接拒绝）的立即失败
+        :param handle: 连接返回的句柄，MqttConnection的CommandHandle或paho的MQTTMessageInfo
+        """
+        request.handle = handle
+        if getattr(handle, 'status', None) == DROPPED or getattr(handle, 'rc', 0) != 0:
+            self.fail(request.sequence_id, ConnectionError('command dropped'))
+        elif request.future.done():
+            # 入队前已经超时或失败
+            self._cancel(request)
+
+    def resolve(self, body: dict) -> bool:
+        """
+        收到命令回复时在网络线程中调用
+        :param body: 回复中section对应的对象，含sequence_id和command
+        :return: 是否匹配到了等待中的命令
+        """
+        sequence_id = body.get('sequence_id')
+        with self.lock:
+            request = self.pending.get(sequence_id)
+            if request is None or request.command != body.get('command'):
+                return False
+            del self.pending[sequence_id]
+
+        now = time.monotonic()
+        # 不算在发送队列里的排队时间，只看网络和打印机的响应
+        sent_at = getattr(request.handle, 'sent_at', None) or request.created_at
+        stats = self.rtt.get(request.command)
+        if stats is None:
+            stats = self.rtt[request.command] = LatencyStats()
+        stats.add(now - sent_at)
+
+        if not request.future.done():
+            request.future.set_result(body)
+        return True
+
+    def disconnected(self):
+        """
+        连接断开时调用，已经交给paho的命令的回复不会再收到，直接失败；还在发送队列里的命令重连后照常发出
+        paho的MQTTMessageInfo（asyncio客户端）没有发送队列，断开时写没写出去都不会再有回复
+        """
+        with self.lock:
+            lost = [request for request in self.pending.values()
+                    if request.handle is not None and getattr(request.handle, 'status', None) != QUEUED]
+        for request in lost:
+            self.fail(request.sequence_id, ConnectionError('disconnected before reply'))
+
+    def fail(self, sequence_id: str, error: Exception):
+        with self.lock:
+            request = self.pending.pop(sequence_id, None)
+        if request is not None:
+            self._cancel(request)
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    @staticmethod
+    def _cancel(request: PendingRequest):
+        # 调用方已经得到失败的结果，还在发送队列里的命令不能再发出去
+        cancel = getattr(request.handle, 'cancel', None)
+        if cancel is not None:
+            cancel()
+
+    def expire(self, now: float):
+        """
+        定时调用，超时的命令以CommandTimeout结束
+        """
+        with self.lock:
+            expired = [request for request in self.pending.values() if request.deadline <= now]
+            for request in expired:
+                del self.pending[request.sequence_id]
+        for request in expired:
+            self._cancel(request)
+            if not request.future.done():
+                request.future.set_exception(
+                    CommandTimeout(f'no reply to {request.command} #{request.sequence_id}'))
+
+    def rtt_summary(self) -> dict:
+        """
+        :return: command -> LatencyStats.summary()
+        """
+        return {command: stats.summary() for command, stats in list(self.rtt.items())}
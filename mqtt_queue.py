@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+
+from mqtt_json import loads
+from mqtt_stats import LatencyStats
+
+# 队列已满时的策略
+BLOCK = 'block'  # 最多等待block_timeout秒，仍然没有空位时丢弃；网络线程内调用时不等待直接丢弃
+DROP = 'drop'  # 丢弃新命令
+COALESCE = 'coalesce'  # 默认策略，同一key的命令只保留最新的一条；队列满且没有可合并的命令时丢弃新命令
+
+# CommandHandle.status
+QUEUED = 'queued'
+SENDING = 'sending'  # 已交给paho，等待写入socket，不能再取消
+SENT = 'sent'  # 已写入socket
+DROPPED = 'dropped'  # 队列已满或连接断开，没有发出
+REPLACED = 'replaced'  # 发出前被同一key的新命令替换
+CANCELLED = 'cancelled'  # 发出前被取消，如等待回复超时
+
+# 优先级通道，数字小的先发
+URGENT = 0  # 停止、暂停、继续等安全相关的命令，不受队列容量限制
+NORMAL = 1
+BULK = 2  # G-code、完整状态请求等大量或较重的消息
+LANE_NAMES = ('urgent', 'normal', 'bulk')
+
+COMMAND_PRIORITY = {
+    'stop': URGENT,
+    'pause': URGENT,
+    'resume': URGENT,
+    'pushall': BULK,
+    'gcode_line': BULK,
+}
+
+
+def command_priority(msg) -> int:
+    """
+    按命令名判断优先级，调用方没有指定时使用
+    :param msg: JSON格式的命令，如mqtt_commands.encoder(mqtt_commands.STOP).encode()
+    """
+    try:
+        for body in loads(msg).values():
+            return COMMAND_PRIORITY.get(body.get('command'), NORMAL)
+    except (ValueError, TypeError, AttributeError):
+        pass
+    return NORMAL
+
+
+class CommandHandle:
+    """
+    入队命令的句柄，可以查询或等待命令是否已经发出
+    """
+    __slots__ = ('msg', 'key', 'priority', 'status', 'enqueued_at', 'sent_at', 'event', 'queue')
+
+    def __init__(self, msg, key=None, priority: int = NORMAL, queue: 'CommandQueue' = None):
+        self.msg = msg
+        self.key = key
+        self.priority = priority
+        self.queue = queue  # 所在的队列，取消时要持有它的锁
+        self.status = QUEUED
+        self.enqueued_at = time.monotonic()
+        self.sent_at = None
+        self.event = threading.Event()
+
+    def done(self) -> bool:
+        return self.status not in (QUEUED, SENDING)
+
+    def cancel(self) -> bool:
+        """
+        取消还在队列里的命令，取出时跳过，可以从任意线程调用
+        :return: 是否取消成功，已经交给paho的命令无法取消
+        """
+        if self.queue is not None:
+            return self.queue.cancel(self)
+        if self.status != QUEUED:
+            return False
+        self.finish(CANCELLED)
+        return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        :return: 命令是否已经发出
+        """
+        self.event.wait(timeout)
+        return self.status == SENT
+
+    def finish(self, status: str):
+        if status == SENT:
+            self.sent_at = time.monotonic()
+        self.status = status
+        self.event.set()
+
+
+class CommandQueue:
+    """
+    有界的线程安全发送队列：任意线程入队后立即返回句柄，由网络线程取出发送
+    命令按优先级分成几个通道，取出时总是先取高优先级通道，同一通道内先进先出
+    """
+
+    def __init__(self, maxsize: int = 64, policy: str = COALESCE, block_timeout: float = 1):
+        """
+        :param maxsize: 最多排队的命令数，URGENT通道的命令不受限制
+        :param policy: 队列已满时的策略，BLOCK、DROP或COALESCE；默认不阻塞，断线时界面线程发命令也会立即返回
+        :param block_timeout: BLOCK策略最多等待多久（秒），超时后丢弃
+        """
+        if policy not in (BLOCK, DROP, COALESCE):
+            raise ValueError(f'unknown queue policy {policy}')
+        if block_timeout is None or block_timeout < 0:
+            raise ValueError('block_timeout must be a finite number of seconds')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.lanes = tuple(deque() for _ in LANE_NAMES)
+        self.size = 0  # 所有通道的命令总数
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.on_ready = None  # () -> None，队列由空变为非空时在入队的线程中调用
+        # 每个通道从入队到写入socket的排队时间，只在网络线程中更新
+        self.latency = tuple(LatencyStats() for _ in LANE_NAMES)
+
+    def __len__(self):
+        return self.size
+
+    def put(self, msg, key=None, block: bool = True, priority: int = None) -> CommandHandle:
+        """
+        :param key: 合并用的键，如'pushall'，None表示不参与合并
+        :param block: 为False时即使策略为BLOCK也不等待
+        :param priority: URGENT、NORMAL或BULK，None表示按命令名判断
+        """
+        if priority is None:
+            priority = command_priority(msg)
+        handle = CommandHandle(msg, key, priority, self)
+        lane = self.lanes[priority]
+        with self.lock:
+            if self.policy == COALESCE and key is not None:
+                for i, queued in enumerate(lane):
+                    if queued.key == key and queued.status == QUEUED:
+                        lane[i] = handle
+                        queued.finish(REPLACED)
+                        return handle
+
+            if priority != URGENT and self.size >= self.maxsize:
+                self._purge_cancelled()
+            # 安全相关的命令不能因为队列里堆满了G-code而被丢弃或等待
+            if priority != URGENT and self.size >= self.maxsize:
+                if self.policy != BLOCK or not block or \
+                        not self.not_full.wait_for(lambda: self.size < self.maxsize, self.block_timeout):
+                    handle.finish(DROPPED)
+                    return handle
+
+            was_empty = not self.size
+            lane.append(handle)
+            self.size += 1
+
+        if was_empty and self.on_ready is not None:
+            self.on_ready()
+        return handle
+
+    def take(self, max_items: int) -> list:
+        """
+        按优先级取出最多max_items条命令，在网络线程中调用
+        """
+        batch = []
+        taken = 0
+        with self.lock:
+            for lane in self.lanes:
+                while lane and len(batch) < max_items:
+                    handle = lane.popleft()
+                    taken += 1
+                    if handle.status == QUEUED:  # 跳过已取消的命令
+                        handle.status = SENDING
+                        batch.append(handle)
+            if taken:
+                self.size -= taken
+                self.not_full.notify(taken)
+        return batch
+
+    def cancel(self, handle: CommandHandle) -> bool:
+        """
+        与take()共用锁，取消成功的命令一定不会再交给paho
+        :return: 是否取消成功，已经取出的命令无法取消
+        """
+        with self.lock:
+            if handle.status != QUEUED:
+                return False
+            handle.finish(CANCELLED)
+            return True
+
+    def _purge_cancelled(self):
+        # 队列满时先清掉已取消的命令，它们不应占着空位，调用时已持有锁
+        for lane in self.lanes:
+            if any(handle.status != QUEUED for handle in lane):
+                kept = [handle for handle in lane if handle.status == QUEUED]
+                self.size -= len(lane) - len(kept)
+                lane.clear()
+                lane.extend(kept)
+
+    def sent(self, handle: CommandHandle):
+        """
+        命令写入socket后由网络线程调用，记录排队时间
+        """
+        handle.finish(SENT)
+        self.latency[handle.priority].add(handle.sent_at - handle.enqueued_at)
+
+    def latency_summary(self) -> dict:
+        """
+        :return: 通道名 -> LatencyStats.summary()
+        """
+        return {name: stats.summary() for name, stats in zip(LANE_NAMES, self.latency)}
@@ -0,0 +1,189 @@
+"""
+原始报告录制
+
+数据文件由若干独立压缩的块组成，每块前有一个块头；旁边的 .idx 索引文件记录每块的时间范围和偏移，
+回放时可以直接定位到任意时间点，不必解压之前的内容。
+
+块头: magic(4s) 压缩后长度(I) 记录数(I)
+块内每条记录: 时间戳(d) 长度(I) 原始报告
+索引项: 首条时间戳(d) 末条时间戳(d) 块偏移(Q) 压缩后长度(I) 记录数(I)
+"""
+import bisect
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from mqtt_engine import EVENT_REPORT
+
+CHUNK_MAGIC = b'A1RC'
+CHUNK_HEADER = struct.Struct('<4sII')
+RECORD_HEADER = struct.Struct('<dI')
+INDEX_ENTRY = struct.Struct('<ddQII')
+
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+
+class ReportRecorder:
+    """
+    把收到的原始报告追加到压缩日志
+    record()只是入队，压缩和写盘在后台线程批量完成，不占用接收线程的时间
+    """
+
+    def __init__(self, path: str, chunk_bytes: int = 256 * 1024, flush_interval: float = 5):
+        """
+        :param path: 数据文件路径，已存在时追加
+        :param chunk_bytes: 每块未压缩数据达到这个大小就写盘
+        :param flush_interval: 最长多久写一次盘（秒）
+        """
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.flush_interval = flush_interval
+
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='mqtt-recorder', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def record(self, payload: bytes, timestamp: float = None):
+        self.queue.put((timestamp if timestamp is not None else time.time(), payload))
+
+    def on_engine_event(self, event: str, data):
+        # 作为MonitorEngine的监听器使用
+        if event == EVENT_REPORT:
+            self.record(data)
+
+    def run(self):
+        with open(self.path, 'ab') as data_file, open(index_path(self.path), 'ab') as index_file:
+            records = []
+            size = 0
+            deadline = None
+            running = True
+            while running:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = ()
+
+                if item is None:
+                    running = False
+                elif item:
+                    if not records:
+                        deadline = time.monotonic() + self.flush_interval
+                    records.append(item)
+                    size += RECORD_HEADER.size + len(item[1])
+                    if size < self.chunk_bytes:
+                        continue
+
+                if records:
+                    self.write_chunk(data_file, index_file, records)
+                    records = []
+                    size = 0
+                    deadline = None
+
+    @staticmethod
+    def write_chunk(data_file, index_file, records: list):
+        raw = b''.join(RECORD_HEADER.pack(ts, len(payload)) + payload for ts, payload in records)
+        compressed = zlib.compress(raw)
+
+        offset = data_file.tell()
+        data_file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(compressed), len(records)))
+        data_file.write(compressed)
+        data_file.flush()
+
+        # 索引在数据之后写入，中途崩溃时索引不会指向不完整的块
+        index_file.write(INDEX_ENTRY.pack(records[0][0], records[-1][0], offset, len(compressed), len(records)))
+        index_file.flush()
+
+
+class RecordingReader:
+    """
+    读取录制文件，可以从任意时间点开始迭代
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.chunks = self.load_index()
+        self.last_timestamps = [chunk[1] for chunk in self.chunks]
+
+    def load_index(self) -> list:
+        """
+        :return: [(first_ts, last_ts, offset, length, count), ...]
+        """
+        try:
+            with open(index_path(self.path), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self.scan_chunks()
+
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return [entry for entry in INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    def scan_chunks(self) -> list:
+        # 没有索引时按块头逐块扫描，需要解压才能拿到时间范围
+        chunks = []
+        with open(self.path, 'rb') as f:
+            while True:
+                offset = f.tell()
+                header = f.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size:
+                    break
+                magic, length, count = CHUNK_HEADER.unpack(header)
+                if magic != CHUNK_MAGIC:
+                    break
+                compressed = f.read(length)
+                if len(compressed) < length:
+                    break
+                records = list(self.decode_chunk(compressed))
+                chunks.append((records[0][0], records[-1][0], offset, length, count))
+        return chunks
+
+    @staticmethod
+    def decode_chunk(compressed: bytes):
+        raw = zlib.decompress(compressed)
+        pos = 0
+        while pos < len(raw):
+            timestamp, length = RECORD_HEADER.unpack_from(raw, pos)
+            pos += RECORD_HEADER.size
+            yield timestamp, raw[pos:pos + length]
+            pos += length
+
+    @property
+    def start_time(self) -> float:
+        return self.chunks[0][0] if self.chunks else 0
+
+    @property
+    def end_time(self) -> float:
+        return self.chunks[-1][1] if self.chunks else 0
+
+    def __len__(self):
+        return sum(chunk[4] for chunk in self.chunks)
+
+    def __iter__(self):
+        return self.iter_from(None)
+
+    def iter_from(self, timestamp: float = None):
+        """
+        :param timestamp: 从这个时间点开始，None表示从头开始
+        :return: 迭代 (timestamp, payload)
+        """
+        first = 0 if timestamp is None else bisect.bisect_left(self.last_timestamps, timestamp)
+        with open(self.path, 'rb') as f:
+            for first_ts, last_ts, offset, length, count in self.chunks[first:]:
+                f.seek(offset + CHUNK_HEADER.size)
+                for record in self.decode_chunk(f.read(length)):
+                    if timestamp is None or record[0] >= timestamp:
+                        yield record
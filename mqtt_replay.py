@@ -0,0 +1,222 @@
+"""
+回放录制的报告，不需要连接打印机
+
+    python mqtt_replay.py session.rec --speed 600          # 600倍速
+    python mqtt_replay.py session.rec --speed 0 --gui      # 尽可能快，同时驱动MainWindow
+    python mqtt_replay.py benchmarks/payloads.jsonl --repeat 1000 --json
+
+支持ReportRecorder录制的文件，以及每行一条报告的.jsonl文件（按1秒间隔回放）
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from mqtt_engine import MonitorEngine
+from mqtt_recorder import RecordingReader
+from mqtt_stats import LatencyStats
+
+
+def read_jsonl(path: str, interval: float = 1):
+    with open(path, 'rb') as f:
+        payloads = [line.rstrip(b'\r\n') for line in f if line.strip()]
+    for i, payload in enumerate(payloads):
+        yield i * interval, payload
+
+
+class ReplaySource:
+    """
+    回放来源，接口与MqttConnection相同，可以直接交给MonitorEngine
+    """
+
+    def __init__(self, path: str, speed: float = 1, start_time: float = None, repeat: int = 1, sn: str = 'replay'):
+        """
+        :param path: 录制文件或.jsonl文件
+        :param speed: 回放倍速，1为实时，0为不等待尽可能快
+        :param start_time: 从录制中的这个时间点开始，None表示从头开始
+        :param repeat: 重复回放的次数
+        """
+        self.path = path
+        self.speed = speed
+        self.start_time = start_time
+        self.repeat = repeat
+        self.sn = sn
+
+        self.on_connected = None
+        self.on_disconnected = None
+        self.on_payload = None
+        self.on_finished = None  # () -> None，回放结束后在回放线程中调用
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.message_count = 0
+        self.byte_count = 0
+        self.published: list = []
+        self.elapsed: float = 0
+        self.process_latency = LatencyStats()  # on_payload处理一条报告的耗时
+        self.schedule_lag = LatencyStats()  # 实际送出时间比计划时间晚了多少
+
+    def records(self):
+        if self.path.endswith('.jsonl'):
+            return read_jsonl(self.path)
+        return RecordingReader(self.path).iter_from(self.start_time)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f'replay-{self.sn}', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def call_later(self, delay: float, callback):
+        # 回放没有网络线程，用独立的定时器线程
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def publish(self, msg, key=None, priority=None):
+        # 回放时没有打印机，命令只做记录
+        self.published.append(msg)
+
+    def run(self):
+        if self.on_connected is not None:
+            self.on_connected()
+
+        begin = time.perf_counter()
+        offset = 0.0
+        for _ in range(self.repeat):
+            last_timestamp = None
+            first_timestamp = None
+            for timestamp, payload in self.records():
+                if self.stop_event.is_set():
+                    break
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                last_timestamp = timestamp
+
+                if self.speed > 0:
+                    due = begin + (offset + timestamp - first_timestamp) / self.speed
+                    wait = due - time.perf_counter()
+                    if wait > 0 and self.stop_event.wait(wait):
+                        break
+                    self.schedule_lag.add(max(0.0, time.perf_counter() - due))
+
+                t0 = time.perf_counter()
+                self.on_payload(payload)
+                self.process_latency.add(time.perf_counter() - t0)
+                self.message_count += 1
+                self.byte_count += len(payload)
+
+            if last_timestamp is not None:
+                offset += last_timestamp - first_timestamp
+            if self.stop_event.is_set():
+                break
+
+        self.elapsed = time.perf_counter() - begin
+        if self.on_disconnected is not None:
+            self.on_disconnected(0)
+        if self.on_finished is not None:
+            self.on_finished()
+
+    def report(self) -> dict:
+        return {
+            'messages': self.message_count,
+            'bytes': self.byte_count,
+            'elapsed_s': self.elapsed,
+            'messages_per_s': self.message_count / self.elapsed if self.elapsed else 0,
+            'process_latency': self.process_latency.summary(),
+            'schedule_lag': self.schedule_lag.summary(),
+        }
+
+
+def run_headless(source: ReplaySource) -> dict:
+    engine = MonitorEngine(source)
+    finished = threading.Event()
+    source.on_finished = finished.set
+    engine.start()
+    finished.wait()
+    engine.stop()
+
+    result = source.report()
+    result['parsed'] = engine.parsed_count
+    result['dropped'] = engine.dropped_count
+    return result
+
+
+def run_gui(source: ReplaySource, max_fps: float = None) -> dict:
+    # 只有需要界面时才导入Qt
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    from mqtt_mainwindow import MainWindow
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    engine = MonitorEngine(source)
+    config = {'max_fps': max_fps} if max_fps else {}
+    window = MainWindow(engine, config)
+
+    # 统计每次界面刷新的耗时
+    render_latency = LatencyStats()
+    update_monitor_info = window.update_monitor_info
+
+    def timed_update(delta):
+        t0 = time.perf_counter()
+        update_monitor_info(delta)
+        render_latency.add(time.perf_counter() - t0)
+
+    window.update_monitor_info = timed_update
+    window.show()
+
+    # 回放结束且最后一帧已刷新后退出
+    def check_finished():
+        if not source.thread.is_alive() and not window.render_timer.isActive():
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(check_finished)
+    timer.start(100)
+    app.exec()
+    window.close()
+
+    result = source.report()
+    result['parsed'] = engine.parsed_count
+    result['dropped'] = engine.dropped_count
+    result['render_latency'] = render_latency.summary()
+    return result
+
+
+def print_report(result: dict):
+    print(f"{result['messages']} messages, {result['bytes']} bytes in {result['elapsed_s']:.3f}s "
+          f"({result['messages_per_s']:.0f} msg/s), parsed {result['parsed']}, dropped {result['dropped']}")
+    for name in ('process_latency', 'schedule_lag', 'render_latency'):
+        if name in result:
+            stats = result[name]
+            print(f"{name:<16} n={stats['count']:<8} mean={stats['mean_ms']:.3f}ms "
+                  f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms max={stats['max_ms']:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded printer reports')
+    parser.add_argument('path', help='录制文件或.jsonl文件')
+    parser.add_argument('--speed', type=float, default=1, help='回放倍速，0表示尽可能快')
+    parser.add_argument('--start', type=float, help='从录制中的这个时间戳开始')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--gui', action='store_true', help='同时驱动MainWindow')
+    parser.add_argument('--max-fps', type=float, help='界面最大刷新帧率')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+
+    source = ReplaySource(args.path, speed=args.speed, start_time=args.start, repeat=args.repeat)
+    result = run_gui(source, args.max_fps) if args.gui else run_headless(source)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
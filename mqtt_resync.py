@@ -0,0 +1,59 @@
+import random
+
+
+class ResyncPolicy:
+    """
+    决定什么时候请求完整状态（PUSH_ALL）
+    只有本地状态缺失或可能过期（断线、长时间没有报告）时才请求，同一台打印机两次请求至少间隔min_interval秒，
+    并在spread秒内随机延后，避免整个打印机群在重连后同时发送最重的报告
+    """
+
+    def __init__(self, min_interval: float = 30, spread: float = 0):
+        """
+        :param min_interval: 同一台打印机两次自动请求的最小间隔（秒），请求后没收到完整报告也按这个间隔重试
+        :param spread: 请求随机延后的最大时间（秒），打印机群中按打印机数量设置
+        """
+        self.min_interval = min_interval
+        self.spread = spread
+
+        self.synced = False  # 本地状态是否与打印机一致
+        self.last_request = float('-inf')
+        self.due = None  # 计划请求的时间，None表示没有计划
+
+    def invalidate(self):
+        """
+        断线或长时间没有报告时调用，此后可能漏掉了增量报告
+        """
+        self.synced = False
+
+    def on_full_report(self):
+        self.synced = True
+        self.due = None
+
+    def on_requested(self, now: float):
+        """
+        手动请求完整状态时调用，计入频率限制
+        """
+        self.last_request = now
+
+    def schedule(self, now: float):
+        """
+        需要时安排一次请求，连接建立或报告恢复时调用
+        """
+        if self.synced or self.due is not None:
+            return
+        self.due = max(now + random.uniform(0, self.spread), self.last_request + self.min_interval)
+
+    def check(self, now: float) -> bool:
+        """
+        定时调用
+        :return: 现在是否应该发送PUSH_ALL
+        """
+        if self.due is None or now < self.due:
+            return False
+        if self.synced:
+            self.due = None
+            return False
+        self.last_request = now
+        self.due = now + self.min_interval  # 没收到完整报告时重试
+        return True
@@ -0,0 +1,333 @@
+"""
+把打印机分到多个工作进程上监视，解析和合并在各进程内完成，只把状态增量汇总到主进程
+
+    python mqtt_shard.py --config fleet.json --shards 4
+
+fleet.json的格式与mqtt_fleet.py相同；某个工作进程崩溃后只影响它负责的打印机，并会被自动重启
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from multiprocessing.connection import wait
+
+from mqtt_engine import EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_STATE
+from mqtt_fleet import FleetManager, load_fleet_config, log_summary
+from mqtt_state import PrinterState, StateDelta
+
+LOGGER = logging.getLogger('mqtt_shard')
+
+RESTART_MIN_DELAY = 1
+RESTART_MAX_DELAY = 60
+STABLE_RUN_TIME = 60  # 运行超过这个时间（秒）才算正常，之后再崩溃时重启延迟从头算起
+
+
+def run_shard(shard_id: int, configs: list, conn, flush_interval: float, pushall_rate: float):
+    """
+    工作进程入口：用FleetManager监视分到的打印机，按flush_interval批量发回增量
+    :param conn: 与主进程之间的管道，发送(事件列表, 增量列表)，接收(sn, 命令)，收到None时退出
+    :param pushall_rate: 本分片分到的完整状态请求频率
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由主进程决定何时退出
+
+    fleet = FleetManager(pushall_rate=pushall_rate)
+    for config in configs:
+        engine = fleet.add_printer(config)
+        # 重启后主进程里的状态是过期的，收到第一条报告时发出STALE变化，主进程据此恢复
+        engine.set_stale(True)
+    loop = fleet.loops[0]
+
+    # 只在网络循环线程中访问
+    events = []  # (event, sn, data)
+    pending = {}  # sn -> StateDelta，同一台打印机在一个周期内的增量合并成一条
+
+    # 交给发送线程的数据，主进程处理得慢时发送会阻塞，不能让网络线程等待；阻塞期间新的增量继续合并进来
+    outbox = threading.Condition()
+    outbox_events = []
+    outbox_deltas = {}
+    stopping = False
+
+    def on_fleet_event(sn: str, event: str, data):
+        if event == EVENT_STATE:
+            delta = pending.get(sn)
+            if delta is None:
+                pending[sn] = data
+            else:
+                delta.merge(data)
+        elif event in (EVENT_CONNECTED, EVENT_DISCONNECTED):
+            events.append((event, sn, data))
+
+    def flush():
+        if events or pending:
+            with outbox:
+                outbox_events.extend(events)
+                for sn, delta in pending.items():
+                    queued = outbox_deltas.get(sn)
+                    if queued is None:
+                        outbox_deltas[sn] = delta
+                    else:
+                        queued.merge(delta)
+                outbox.notify()
+            events.clear()
+            pending.clear()
+        loop.call_later(flush_interval, flush)
+
+    def send_batches():
+        while True:
+            with outbox:
+                outbox.wait_for(lambda: outbox_events or outbox_deltas or stopping)
+                if not (outbox_events or outbox_deltas):
+                    return
+                batch = (outbox_events[:], [(sn, delta.pack()) for sn, delta in outbox_deltas.items()])
+                outbox_events.clear()
+                outbox_deltas.clear()
+            try:
+                conn.send(batch)
+            except OSError:
+                return  # 主进程已退出
+
+    sender = threading.Thread(target=send_batches, name=f'shard-{shard_id}-sender', daemon=True)
+    sender.start()
+    fleet.add_listener(on_fleet_event)
+    fleet.start()
+    loop.call_later(flush_interval, flush)
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            sn, msg = message
+            engine = fleet.engines.get(sn)
+            if engine is not None:
+                engine.publish_message(msg)
+    except EOFError:
+        pass  # 主进程已退出
+    fleet.stop()
+    with outbox:
+        stopping = True
+        outbox.notify()
+    sender.join(1)
+
+
+class ShardSupervisor:
+    """
+    启动并看管工作进程，同时作为汇总器在主进程中维护所有打印机的状态副本
+    """
+
+    def __init__(self, configs: list, shards: int = None, flush_interval: float = 0.1, pushall_rate: float = 20):
+        """
+        :param configs: 打印机配置列表
+        :param shards: 工作进程数，默认等于CPU核数
+        :param flush_interval: 工作进程批量发送增量的间隔（秒）
+        :param pushall_rate: 整个打印机群平均每秒最多自动请求多少次完整状态，平分给各分片
+        """
+        shards = shards or os.cpu_count() or 1
+        self.flush_interval = flush_interval
+        self.pushall_rate = pushall_rate / shards
+
+        # 按序列号哈希分片，增删打印机时其余打印机所在的分片不变
+        self.shard_configs = [[] for _ in range(shards)]
+        self.shard_of = {}
+        for config in configs:
+            shard = zlib.crc32(config['sn'].encode()) % shards
+            self.shard_configs[shard].append(config)
+            self.shard_of[config['sn']] = shard
+
+        self.states = {config['sn']: PrinterState() for config in configs}
+        self.connected = set()
+        self.listeners = []
+
+        self.context = multiprocessing.get_context('spawn')  # 主进程有线程，不用fork
+        self.processes = [None] * shards
+        self.conns = [None] * shards
+        self.started_at = [0.0] * shards
+        self.restart_delay = [RESTART_MIN_DELAY] * shards
+        self.restart_at = {}  # shard -> 计划重启的时间
+
+        self.send_lock = threading.Lock()
+        self.wake_r, self.wake_w = self.context.Pipe(duplex=False)
+        self.thread = None
+        self.running = False
+
+    def add_listener(self, listener):
+        """
+        :param listener: (sn: str, event: str, data) -> None，在汇总线程中调用，与FleetManager的监听器相同
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def dispatch(self, sn: str, event: str, data):
+        for listener in self.listeners:
+            try:
+                listener(sn, event, data)
+            except Exception as e:
+                print('事件处理异常', sn, event, e)
+
+    def start(self):
+        self.running = True
+        for shard, configs in enumerate(self.shard_configs):
+            if configs:
+                self.start_shard(shard)
+        self.thread = threading.Thread(target=self.run, name='mqtt-aggregator', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        for shard, conn in enumerate(self.conns):
+            if conn is not None:
+                self.send(shard, None)
+        self.wake_w.send(None)
+        # 汇总线程等所有工作进程退出后结束，超时未退出的直接结束
+        self.thread.join(10)
+        if self.thread.is_alive():
+            for process in self.processes:
+                if process is not None:
+                    process.terminate()
+            self.thread.join()
+
+    def publish(self, sn: str, msg):
+        """
+        向打印机发送命令，由负责它的工作进程转发
+        """
+        self.send(self.shard_of[sn], (sn, msg))
+
+    def send(self, shard: int, message):
+        conn = self.conns[shard]
+        if conn is None:
+            return
+        with self.send_lock:
+            try:
+                conn.send(message)
+            except OSError:
+                pass  # 工作进程已退出，等待重启
+
+    def start_shard(self, shard: int):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=run_shard, name=f'mqtt-shard-{shard}',
+                                       args=(shard, self.shard_configs[shard], child, self.flush_interval,
+                                             self.pushall_rate),
+                                       daemon=True)
+        process.start()
+        child.close()
+        self.processes[shard] = process
+        self.conns[shard] = parent
+        self.started_at[shard] = time.monotonic()
+
+    def run(self):
+        while self.running or any(self.processes):
+            waitables = {self.wake_r: None}
+            for shard, (process, conn) in enumerate(zip(self.processes, self.conns)):
+                if process is not None:
+                    waitables[conn] = shard
+                    waitables[process.sentinel] = shard
+
+            timeout = None
+            if self.restart_at:
+                timeout = max(0.0, min(self.restart_at.values()) - time.monotonic())
+
+            for ready in wait(list(waitables), timeout):
+                shard = waitables[ready]
+                if ready is self.wake_r:
+                    self.wake_r.recv()
+                elif ready is self.conns[shard]:
+                    try:
+                        self.apply_batch(ready.recv())
+                    except EOFError:
+                        pass  # 进程退出，由sentinel处理
+                elif self.processes[shard] is not None:
+                    self.on_shard_exit(shard)
+
+            now = time.monotonic()
+            for shard, when in list(self.restart_at.items()):
+                if not self.running:
+                    self.restart_at.clear()
+                elif when <= now:
+                    del self.restart_at[shard]
+                    self.start_shard(shard)
+
+    def apply_batch(self, batch: tuple):
+        events, deltas = batch
+        for event, sn, data in events:
+            if event == EVENT_CONNECTED:
+                self.connected.add(sn)
+            else:
+                self.connected.discard(sn)
+            self.dispatch(sn, event, data)
+
+        for sn, packed in deltas:
+            state = self.states[sn]
+            mask = state.apply(StateDelta.unpack(packed))
+            if mask:
+                self.dispatch(sn, EVENT_STATE, state.delta(mask))
+
+    def on_shard_exit(self, shard: int):
+        process, conn = self.processes[shard], self.conns[shard]
+        # 退出前已经发出的数据照常处理
+        try:
+            while conn.poll():
+                self.apply_batch(conn.recv())
+        except (EOFError, OSError):
+            pass
+        conn.close()
+        process.join()
+        self.processes[shard] = None
+        self.conns[shard] = None
+
+        if not self.running:
+            return
+
+        print(f'分片{shard}异常退出 exitcode={process.exitcode}')
+        for config in self.shard_configs[shard]:
+            sn = config['sn']
+            if sn in self.connected:
+                self.connected.discard(sn)
+                self.dispatch(sn, EVENT_DISCONNECTED, None)
+            # 重启并收到新的报告之前，显示的是崩溃前的状态
+            state = self.states[sn]
+            mask = state.set_stale(True)
+            if mask:
+                self.dispatch(sn, EVENT_STATE, state.delta(mask))
+
+        if time.monotonic() - self.started_at[shard] > STABLE_RUN_TIME:
+            self.restart_delay[shard] = RESTART_MIN_DELAY
+        self.restart_at[shard] = time.monotonic() + self.restart_delay[shard]
+        self.restart_delay[shard] = min(self.restart_delay[shard] * 2, RESTART_MAX_DELAY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A1 Monitor multi-process fleet daemon')
+    parser.add_argument('--config', default='fleet.json', help='打印机配置列表')
+    parser.add_argument('--shards', type=int, help='工作进程数，默认等于CPU核数')
+    parser.add_argument('--flush-interval', type=float, default=0.1, help='工作进程发送增量的间隔（秒）')
+    parser.add_argument('--summary-interval', type=float, default=60, help='汇总日志的间隔（秒）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    supervisor = ShardSupervisor(load_fleet_config(args.config), args.shards, args.flush_interval)
+
+    def on_fleet_event(sn: str, event: str, data):
+        if event == EVENT_DISCONNECTED:
+            LOGGER.info('%s disconnected rc=%s', sn, data)
+
+    supervisor.add_listener(on_fleet_event)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    supervisor.start()
+    while not stop_event.wait(args.summary_interval):
+        log_summary(supervisor.states, supervisor.connected)
+    supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+"""
+模拟打印机，用于离线的集成测试和压力测试
+
+    python mqtt_simulator.py --printers 200 --rate 1
+
+和真机一样在8883端口提供MQTT over TLS，用户名bblp、密码为访问码，
+打印机发布 device/{sn}/report，接收 device/{sn}/request。
+一个进程可以模拟几百台打印机，序列号为 SIM00000、SIM00001 ...
+没有指定证书时用openssl生成自签名证书（客户端本来就不校验证书）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import struct
+import subprocess
+import tempfile
+import time
+
+# MQTT 3.1.1 报文类型
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_CREDENTIALS = 4
+
+FIRMWARE_VERSION = '01.04.00.00'
+
+
+def encode_remaining_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(s: str) -> bytes:
+    data = s.encode()
+    return struct.pack('!H', len(data)) + data
+
+
+def packet(packet_type: int, body: bytes = b'', flags: int = 0) -> bytes:
+    return bytes([packet_type << 4 | flags]) + encode_remaining_length(len(body)) + body
+
+
+def publish_packet(topic: str, payload: bytes) -> bytes:
+    return packet(PUBLISH, encode_string(topic) + payload)
+
+
+def read_string(data: bytes, pos: int) -> tuple:
+    length, = struct.unpack_from('!H', data, pos)
+    pos += 2
+    return data[pos:pos + length].decode(), pos + length
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(1)
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b''
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+class SimulatedPrinter:
+    """
+    一台模拟打印机的状态，按真机的字段名生成报告
+    """
+
+    def __init__(self, sn: str, access_code: str, job_minutes: float):
+        self.sn = sn
+        self.access_code = access_code
+        self.job_minutes = job_minutes
+        self.report_topic = f'device/{sn}/report'
+        self.request_topic = f'device/{sn}/request'
+
+        self.subscribers: set = set()
+        self.sequence_id = 0
+        self.tick_count = 0
+
+        self.gcode_state = 'RUNNING'
+        self.stage = 0
+        self.speed_level = 2
+        self.job_start = time.time() - random.uniform(0, job_minutes * 60)
+        self.total_layer = random.randint(50, 500)
+        self.nozzle_target = 220
+        self.bed_target = 60
+        self.nozzle = 220.0
+        self.bed = 60.0
+        self.wifi = -45
+        self.chamber_light = 'on'
+        self.paused_at = None
+
+    def next_sequence_id(self) -> str:
+        self.sequence_id += 1
+        return str(self.sequence_id)
+
+    def progress(self) -> float:
+        if self.paused_at is not None:
+            elapsed = self.paused_at - self.job_start
+        else:
+            elapsed = time.time() - self.job_start
+        return min(1.0, elapsed / (self.job_minutes * 60))
+
+    def advance(self):
+        if self.gcode_state == 'RUNNING' and self.progress() >= 1:
+            self.gcode_state = 'FINISH'
+            self.stage = 255
+            self.nozzle_target = 0
+            self.bed_target = 0
+        elif self.gcode_state in ('FINISH', 'FAILED') and time.time() - self.job_start > self.job_minutes * 90:
+            # 空闲一段时间后开始下一个任务
+            self.start_job()
+
+        self.nozzle += (self.nozzle_target - self.nozzle) * 0.2 + random.uniform(-0.5, 0.5)
+        self.bed += (self.bed_target - self.bed) * 0.2 + random.uniform(-0.2, 0.2)
+        self.nozzle = max(25.0, self.nozzle)
+        self.bed = max(25.0, self.bed)
+
+    def start_job(self):
+        self.gcode_state = 'RUNNING'
+        self.stage = 0
+        self.job_start = time.time()
+        self.total_layer = random.randint(50, 500)
+        self.nozzle_target = 220
+        self.bed_target = 60
+        self.paused_at = None
+
+    def progress_fields(self) -> dict:
+        progress = self.progress() if self.gcode_state in ('RUNNING', 'PAUSE') else 1
+        return {
+            'mc_percent': int(progress * 100),
+            'mc_remaining_time': int(round((1 - progress) * self.job_minutes)),
+            'layer_num': int(progress * self.total_layer),
+        }
+
+    def partial_report(self) -> dict:
+        """
+        真机大部分报告只带少量变化的字段
+        """
+        self.tick_count += 1
+        data = {
+            'nozzle_temper': round(self.nozzle, 2),
+            'bed_temper': round(self.bed, 2),
+            'mc_print_line_number': str(int(self.progress() * 100000)),
+        }
+        if self.tick_count % 5 == 0:
+            data.update(self.progress_fields())
+        if self.tick_count % 7 == 0:
+            self.wifi = random.randint(-60, -35)
+            data['wifi_signal'] = f'{self.wifi}dBm'
+        data.update({'command': 'push_status', 'msg': 1, 'sequence_id': self.next_sequence_id()})
+        return {'print': data}
+
+    def full_report(self) -> dict:
+        data = {
+            'upload': {'status': 'idle', 'progress': 0, 'message': ''},
+            'nozzle_temper': round(self.nozzle, 2),
+            'nozzle_target_temper': self.nozzle_target,
+            'bed_temper': round(self.bed, 2),
+            'bed_target_temper': self.bed_target,
+            'chamber_temper': 5,
+            'heatbreak_fan_speed': '15',
+            'cooling_fan_speed': '15' if self.gcode_state == 'RUNNING' else '0',
+            'big_fan1_speed': '0',
+            'big_fan2_speed': '0',
+            'spd_mag': 100,
+            'spd_lvl': self.speed_level,
+            'print_error': 0,
+            'lifecycle': 'product',
+            'wifi_signal': f'{self.wifi}dBm',
+            'gcode_state': self.gcode_state,
+            'gcode_file_prepare_percent': '100',
+            'subtask_name': f'{self.sn}_job',
+            'gcode_file': '/data/Metadata/plate_1.gcode',
+            'stg': [2, 14, 1],
+            'stg_cur': self.stage,
+            'print_type': 'local',
+            'home_flag': 322454935,
+            'mc_print_line_number': str(int(self.progress() * 100000)),
+            'sdcard': True,
+            'total_layer_num': self.total_layer,
+            'hms': [],
+            'nozzle_diameter': '0.4',
+            'nozzle_type': 'stainless_steel',
+            'online': {'ahb': False, 'rfid': False, 'version': 1413286149},
+            'ams': {'ams': [{'id': '0', 'humidity': '5', 'temp': '0.0', 'tray': [
+                {'id': str(i), 'remain': 100 - i * 10, 'tray_info_idx': 'GFA00', 'tray_type': 'PLA',
+                 'tray_color': 'FFFFFFFF', 'nozzle_temp_max': '230', 'nozzle_temp_min': '190'} for i in range(4)]}],
+                'ams_exist_bits': '1', 'tray_exist_bits': 'f', 'tray_now': '2', 'version': 4},
+            'lights_report': [{'node': 'chamber_light', 'mode': self.chamber_light}],
+            'msg': 0,
+            'command': 'push_status',
+            'sequence_id': self.next_sequence_id(),
+        }
+        data.update(self.progress_fields())
+        return {'print': data}
+
+    def handle_request(self, request: dict) -> list:
+        """
+        处理客户端发来的命令
+        :return: 需要发布的报告列表
+        """
+        replies = []
+        for section, body in request.items():
+            if not isinstance(body, dict):
+                continue
+            command = body.get('command')
+            reply = {'command': command, 'sequence_id': body.get('sequence_id', '0')}
+
+            if section == 'pushing' and command == 'pushall':
+                replies.append(self.full_report())
+                continue
+            if section == 'pushing' and command == 'start':
+                continue
+
+            if section == 'info' and command == 'get_version':
+                reply['module'] = [{'name': 'ota', 'project_name': 'N2S', 'sw_ver': FIRMWARE_VERSION,
+                                    'hw_ver': 'OTA', 'sn': self.sn}]
+            elif section == 'print' and command == 'pause':
+                if self.gcode_state == 'RUNNING':
+                    self.gcode_state = 'PAUSE'
+                    self.stage = 16
+                    self.paused_at = time.time()
+            elif section == 'print' and command == 'resume':
+                if self.gcode_state == 'PAUSE':
+                    self.job_start += time.time() - self.paused_at
+                    self.paused_at = None
+                    self.gcode_state = 'RUNNING'
+                    self.stage = 0
+            elif section == 'print' and command == 'stop':
+                self.gcode_state = 'FAILED'
+                self.stage = 255
+                self.nozzle_target = 0
+                self.bed_target = 0
+                self.paused_at = None
+            elif section == 'print' and command == 'print_speed':
+                try:
+                    self.speed_level = int(body.get('param', self.speed_level))
+                except ValueError:
+                    reply['result'] = 'failed'
+            elif section == 'print' and command == 'gcode_line':
+                reply['param'] = body.get('param', '')
+            elif section == 'system' and command == 'ledctrl':
+                self.chamber_light = body.get('led_mode', self.chamber_light)
+                reply['led_node'] = body.get('led_node')
+                reply['led_mode'] = self.chamber_light
+            else:
+                reply['result'] = 'failed'
+                reply['reason'] = 'unsupported command'
+
+            reply.setdefault('result', 'success')
+            reply.setdefault('reason', '')
+            replies.append({section: reply})
+
+            # 状态类命令执行后，真机会紧接着推送一次状态
+            if section == 'print' and command in ('pause', 'resume', 'stop', 'print_speed'):
+                replies.append({'print': {'gcode_state': self.gcode_state, 'stg_cur': self.stage,
+                                          'spd_lvl': self.speed_level, 'command': 'push_status', 'msg': 1,
+                                          'sequence_id': self.next_sequence_id()}})
+        return replies
+
+
+class Session:
+    """
+    一个客户端连接
+    """
+
+    def __init__(self, simulator: 'PrinterSimulator', reader, writer):
+        self.simulator = simulator
+        self.reader = reader
+        self.writer = writer
+        self.access_code = None
+        self.printers: set = set()
+
+    def send(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def publish(self, topic: str, report: dict):
+        self.send(publish_packet(topic, json.dumps(report).encode()))
+
+    async def run(self):
+        try:
+            packet_type, flags, body = await asyncio.wait_for(read_packet(self.reader), 10)
+            if packet_type != CONNECT or not self.handle_connect(body):
+                return
+            keepalive = self.keepalive
+
+            while True:
+                timeout = keepalive * 1.5 if keepalive else None
+                packet_type, flags, body = await asyncio.wait_for(read_packet(self.reader), timeout)
+                if packet_type == PUBLISH:
+                    self.handle_publish(flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self.handle_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self.handle_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(packet(PINGRESP))
+                elif packet_type == DISCONNECT:
+                    return
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            for printer in self.printers:
+                printer.subscribers.discard(self)
+            self.writer.close()
+
+    def handle_connect(self, body: bytes) -> bool:
+        protocol, pos = read_string(body, 0)
+        level, flags, self.keepalive = struct.unpack_from('!BBH', body, pos)
+        pos += 4
+        client_id, pos = read_string(body, pos)
+        if flags & 0x04:  # will
+            _, pos = read_string(body, pos)
+            _, pos = read_string(body, pos)
+        username = password = None
+        if flags & 0x80:
+            username, pos = read_string(body, pos)
+        if flags & 0x40:
+            password, pos = read_string(body, pos)
+
+        if username != 'bblp' or password not in self.simulator.access_codes:
+            self.send(packet(CONNACK, bytes([0, CONNACK_BAD_CREDENTIALS])))
+            return False
+
+        self.access_code = password
+        self.send(packet(CONNACK, bytes([0, CONNACK_ACCEPTED])))
+        return True
+
+    def find_printer(self, topic: str, kind: str):
+        parts = topic.split('/')
+        if len(parts) != 3 or parts[0] != 'device' or parts[2] != kind:
+            return None
+        printer = self.simulator.printers.get(parts[1])
+        if printer is None or printer.access_code != self.access_code:
+            return None
+        return printer
+
+    def handle_subscribe(self, body: bytes):
+        packet_id, = struct.unpack_from('!H', body, 0)
+        pos = 2
+        codes = bytearray()
+        while pos < len(body):
+            topic, pos = read_string(body, pos)
+            pos += 1  # 请求的QoS，统一按0处理
+            printer = self.find_printer(topic, 'report')
+            if printer is None:
+                codes.append(0x80)
+                continue
+            printer.subscribers.add(self)
+            self.printers.add(printer)
+            codes.append(0)
+        self.send(packet(SUBACK, struct.pack('!H', packet_id) + bytes(codes)))
+
+    def handle_unsubscribe(self, body: bytes):
+        packet_id, = struct.unpack_from('!H', body, 0)
+        pos = 2
+        while pos < len(body):
+            topic, pos = read_string(body, pos)
+            printer = self.find_printer(topic, 'report')
+            if printer is not None:
+                printer.subscribers.discard(self)
+                self.printers.discard(printer)
+        self.send(packet(UNSUBACK, struct.pack('!H', packet_id)))
+
+    def handle_publish(self, flags: int, body: bytes):
+        topic, pos = read_string(body, 0)
+        qos = (flags >> 1) & 0x03
+        if qos:
+            packet_id, = struct.unpack_from('!H', body, pos)
+            pos += 2
+            self.send(packet(PUBACK, struct.pack('!H', packet_id)))
+
+        printer = self.find_printer(topic, 'request')
+        if printer is None:
+            return
+        try:
+            request = json.loads(body[pos:])
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+        self.simulator.requests += 1
+        for report in printer.handle_request(request):
+            self.publish(printer.report_topic, report)
+
+
+class PrinterSimulator:
+    """
+    在一个事件循环里模拟多台打印机
+    """
+
+    def __init__(self, printers: list, rate: float):
+        """
+        :param printers: SimulatedPrinter列表
+        :param rate: 每台打印机每秒推送的报告数
+        """
+        self.printers = {printer.sn: printer for printer in printers}
+        self.access_codes = {printer.access_code for printer in printers}
+        self.rate = rate
+        self.reports = 0
+        self.requests = 0
+
+    async def on_client(self, reader, writer):
+        await Session(self, reader, writer).run()
+
+    async def push_reports(self, printer: SimulatedPrinter):
+        interval = 1 / self.rate
+        # 错开各台打印机的推送时间
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            printer.advance()
+            if printer.subscribers:
+                data = publish_packet(printer.report_topic, json.dumps(printer.partial_report()).encode())
+                for session in list(printer.subscribers):
+                    session.send(data)
+                self.reports += 1
+            await asyncio.sleep(interval)
+
+    async def serve(self, host: str, port: int, ssl_context: ssl.SSLContext):
+        server = await asyncio.start_server(self.on_client, host, port, ssl=ssl_context)
+        tasks = [asyncio.ensure_future(self.push_reports(printer)) for printer in self.printers.values()]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def create_printers(count: int, access_code: str, sn_prefix: str = 'SIM', job_minutes: float = 120) -> list:
+    return [SimulatedPrinter(f'{sn_prefix}{i:05d}', access_code, job_minutes) for i in range(count)]
+
+
+def generate_certificate(directory: str) -> tuple:
+    certfile = os.path.join(directory, 'simulator.crt')
+    keyfile = os.path.join(directory, 'simulator.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=bambu-simulator', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def create_ssl_context(certfile: str = None, keyfile: str = None) -> ssl.SSLContext:
+    if certfile is None:
+        certfile, keyfile = generate_certificate(tempfile.mkdtemp(prefix='bambu-simulator-'))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated Bambu printers (MQTT over TLS)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8883)
+    parser.add_argument('--printers', type=int, default=1, help='模拟的打印机数量')
+    parser.add_argument('--access-code', default='12345678', help='所有模拟打印机共用的访问码')
+    parser.add_argument('--sn-prefix', default='SIM')
+    parser.add_argument('--rate', type=float, default=1, help='每台打印机每秒推送的报告数')
+    parser.add_argument('--job-minutes', type=float, default=120, help='模拟任务的时长（分钟）')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    printers = create_printers(args.printers, args.access_code, args.sn_prefix, args.job_minutes)
+    simulator = PrinterSimulator(printers, args.rate)
+    ssl_context = create_ssl_context(args.certfile, args.keyfile)
+
+    print(f'simulating {len(printers)} printers on {args.host}:{args.port}, '
+          f'{printers[0].sn} .. {printers[-1].sn}, access code {args.access_code}')
+    try:
+        asyncio.run(simulator.serve(args.host, args.port, ssl_context))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import operator
+import time
+from functools import reduce
+
+# 字段变化掩码，merge()返回这些位的组合
+TASK_NAME = 1 << 0
+REMAINING_TIME = 1 << 1
+NOZZLE_TEMPERATURE = 1 << 2
+NOZZLE_TARGET_TEMPERATURE = 1 << 3
+HOTBED_TEMPERATURE = 1 << 4
+HOTBED_TARGET_TEMPERATURE = 1 << 5
+TASK_PERCENT = 1 << 6
+CURR_LAYER = 1 << 7
+TOTAL_LAYER = 1 << 8
+STAGE_CODE = 1 << 9
+WIFI_SIGNAL = 1 << 10
+CHAMBER_TEMPERATURE = 1 << 11
+PART_COOLING_FAN = 1 << 12
+AUX_FAN = 1 << 13
+CHAMBER_FAN = 1 << 14
+HEATBREAK_FAN = 1 << 15
+AMS = 1 << 16
+HMS = 1 << 17
+STALE = 1 << 18
+
+
+def fan_percentage(speed) -> int:
+    # 风扇转速以0~15的字符串上报，换算成10%步进的百分比
+    return round(int(speed) / 15 * 10) * 10
+
+
+def _merge_by_id(current, update: list, child_key: str = None) -> list:
+    # 按id合并对象列表，没有出现在增量中的项保持不变
+    merged = list(current) if isinstance(current, list) else []
+    index = {item.get('id'): i for i, item in enumerate(merged) if isinstance(item, dict)}
+    for item in update:
+        i = index.get(item.get('id')) if isinstance(item, dict) else None
+        if i is None:
+            if isinstance(item, dict):
+                index[item.get('id')] = len(merged)
+            merged.append(item)
+            continue
+        old = merged[i]
+        new = dict(old)
+        new.update(item)
+        if child_key is not None and isinstance(item.get(child_key), list):
+            new[child_key] = _merge_by_id(old.get(child_key), item[child_key])
+        merged[i] = new
+    return merged
+
+
+def merge_ams(current, update: dict) -> dict:
+    """
+    增量报告中的ams只包含变化的部分，如只有tray_now，合并到当前值的副本上
+    ams列表按id逐个AMS单元合并，单元中的tray列表按id逐个料盘合并
+    不修改current，已经发出的增量里可能还引用着它
+    """
+    if not isinstance(update, dict):
+        raise TypeError('ams must be an object')
+    merged = dict(current) if current else {}
+    for key, value in update.items():
+        if key == 'ams' and isinstance(value, list):
+            merged[key] = _merge_by_id(merged.get(key), value, 'tray')
+        else:
+            merged[key] = value
+    return merged
+
+
+class ReportField:
+    """
+    print报告中的一个字段与状态属性的对应关系
+    """
+    __slots__ = ('key', 'name', 'bit', 'default', 'convert', 'merge')
+
+    def __init__(self, key: str, name: str, bit: int, default, convert=None, merge=None):
+        self.key = key  # 报告中的键名
+        self.name = name  # PrinterState属性名
+        self.bit = bit  # 变化掩码位
+        self.default = default
+        self.convert = convert  # 值转换函数，None表示原样保存
+        self.merge = merge  # (当前值, 报告中的值) -> 新值，用于报告只带部分内容的对象，None表示直接替换
+
+
+# 需要跟踪的字段，新增字段只需加一个掩码位和一行定义，不在表中的键直接忽略
+REPORT_FIELDS = (
+    ReportField('subtask_name', 'task_name', TASK_NAME, ''),
+    ReportField('mc_remaining_time', 'remaining_time', REMAINING_TIME, -1),
+    ReportField('nozzle_temper', 'nozzle_temperature', NOZZLE_TEMPERATURE, -1),
+    ReportField('nozzle_target_temper', 'nozzle_target_temperature', NOZZLE_TARGET_TEMPERATURE, -1),
+    ReportField('bed_temper', 'hotbed_temperature', HOTBED_TEMPERATURE, -1),
+    ReportField('bed_target_temper', 'hotbed_target_temperature', HOTBED_TARGET_TEMPERATURE, -1),
+    ReportField('mc_percent', 'task_percent', TASK_PERCENT, -1),
+    ReportField('layer_num', 'curr_layer', CURR_LAYER, -1),
+    ReportField('total_layer_num', 'total_layer', TOTAL_LAYER, -1),
+    ReportField('stg_cur', 'stage_code', STAGE_CODE, -1),
+    ReportField('wifi_signal', 'wifi_signal', WIFI_SIGNAL, ''),
+    ReportField('chamber_temper', 'chamber_temperature', CHAMBER_TEMPERATURE, -1),
+    ReportField('cooling_fan_speed', 'part_cooling_fan', PART_COOLING_FAN, -1, fan_percentage),
+    ReportField('big_fan1_speed', 'aux_fan', AUX_FAN, -1, fan_percentage),
+    ReportField('big_fan2_speed', 'chamber_fan', CHAMBER_FAN, -1, fan_percentage),
+    ReportField('heatbreak_fan_speed', 'heatbreak_fan', HEATBREAK_FAN, -1, fan_percentage),
+    ReportField('ams', 'ams', AMS, None, merge=merge_ams),
+    ReportField('hms', 'hms', HMS, (), tuple),
+)
+REPORT_FIELD_MAP = {field.key: field for field in REPORT_FIELDS}
+
+# 不来自报告、由本地维护的字段
+LOCAL_FIELDS = (
+    ReportField(None, 'stale', STALE, False),  # 连接断开或长时间没有收到报告，显示的状态可能已过期
+)
+STATE_FIELDS = REPORT_FIELDS + LOCAL_FIELDS
+
+ALL_FIELDS = reduce(operator.or_, (field.bit for field in STATE_FIELDS))
+
+# 掩码位与属性名的对应关系
+FIELDS = tuple((field.bit, field.name) for field in STATE_FIELDS)
+FIELD_BITS = {name: bit for bit, name in FIELDS}
+
+
+class StateDelta:
+    """
+    一条或多条报告带来的状态变化，在网络线程生成，可以直接跨线程传递
+    """
+    __slots__ = ('mask', 'values')
+
+    def __init__(self, mask: int = 0, values: dict = None):
+        self.mask = mask
+        self.values = values if values is not None else {}
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def merge(self, other: 'StateDelta'):
+        """
+        合并较新的增量，同一字段以新值为准
+        """
+        self.mask |= other.mask
+        self.values.update(other.values)
+
+    def pack(self) -> tuple:
+        """
+        压缩成(mask, 值元组)，字段名由mask决定，用于跨进程传递
+        """
+        return self.mask, tuple(self.values[name] for bit, name in FIELDS if self.mask & bit)
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> 'StateDelta':
+        mask, values = packed
+        return cls(mask, dict(zip((name for bit, name in FIELDS if mask & bit), values)))
+
+
+class PrinterState:
+    """
+    打印机状态模型
+    增量报告合并进来时只返回真正变化的字段，消费者据此跳过无关的更新
+    """
+    __slots__ = tuple(field.name for field in STATE_FIELDS) + ('last_update',)
+
+    def __init__(self):
+        for field in STATE_FIELDS:
+            setattr(self, field.name, field.default)
+        self.last_update: float = 0
+
+    def merge(self, data: dict) -> int:
+        """
+        合并一条print报告
+        :param data: 报告中的print对象，可以只包含部分字段
+        :return: 变化字段的掩码，0表示没有任何变化
+        """
+        # 从较小的一边查表，开销只和相关字段的个数有关
+        if len(data) > len(REPORT_FIELD_MAP):
+            pairs = [(field, data[key]) for key, field in REPORT_FIELD_MAP.items() if key in data]
+        else:
+            pairs = [(REPORT_FIELD_MAP[key], value) for key, value in data.items() if key in REPORT_FIELD_MAP]
+
+        mask = 0
+        for field, value in pairs:
+            try:
+                if field.convert is not None:
+                    value = field.convert(value)
+                if field.merge is not None:
+                    value = field.merge(getattr(self, field.name), value)
+            except (TypeError, ValueError):
+                continue
+
+            if getattr(self, field.name) != value:
+                setattr(self, field.name, value)
+                mask |= field.bit
+
+        self.last_update = time.time()
+        return mask
+
+    def set_stale(self, stale: bool) -> int:
+        """
+        :return: 变化字段的掩码
+        """
+        if self.stale == stale:
+            return 0
+        self.stale = stale
+        return STALE
+
+    def delta(self, mask: int) -> StateDelta:
+        """
+        取出指定字段的当前值
+        :param mask: 字段掩码
+        :return: 只包含这些字段的增量
+        """
+        return StateDelta(mask, {name: getattr(self, name) for bit, name in FIELDS if mask & bit})
+
+    def apply(self, delta: StateDelta) -> int:
+        """
+        应用另一个线程生成的增量，用于维护状态副本
+        :param delta: 状态增量
+        :return: 变化字段的掩码
+        """
+        mask = 0
+        for name, value in delta.values.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                mask |= FIELD_BITS[name]
+        return mask
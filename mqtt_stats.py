@@ -0,0 +1,68 @@
+import math
+
+# 桶按2^(1/4)等比划分，覆盖1微秒到约100秒，相对误差不超过19%
+BUCKET_BASE = 2 ** 0.25
+BUCKET_MIN = 1e-6
+BUCKET_COUNT = 108
+
+
+class LatencyStats:
+    """
+    延迟直方图，内存占用固定，适合长时间累计
+    """
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        if seconds <= BUCKET_MIN:
+            index = 0
+        else:
+            index = min(BUCKET_COUNT - 1, int(math.log(seconds / BUCKET_MIN, BUCKET_BASE)) + 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'LatencyStats'):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: 0~100
+        :return: 所在桶的上界（秒），不超过实测最大值
+        """
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self.max, BUCKET_MIN * BUCKET_BASE ** index)
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        :return: 以毫秒为单位的统计结果
+        """
+        return {
+            'count': self.count,
+            'mean_ms': self.mean * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000,
+        }
@@ -0,0 +1,72 @@
+import ssl
+import threading
+
+
+# TLS握手的超时（秒）。paho把握手超时设为keepalive（默认60秒），打印机接受了TCP连接却不响应时会卡住连接线程
+HANDSHAKE_TIMEOUT = 10
+
+
+class HandshakeTimeoutSocket(ssl.SSLSocket):
+    """
+    握手时使用上下文的handshake_timeout，握手完成后恢复调用方设置的超时
+    """
+
+    def do_handshake(self, block=False):
+        timeout = self.gettimeout()
+        limit = self.context.handshake_timeout
+        if limit is not None and (timeout is None or timeout > limit):
+            self.settimeout(limit)
+        try:
+            super().do_handshake(block)
+        finally:
+            self.settimeout(timeout)
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """
+    记住每台打印机最近一次的TLS会话，重连时尝试恢复会话，省掉完整握手
+    服务端不接受时自动退回完整握手
+    """
+
+    sslsocket_class = HandshakeTimeoutSocket
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.sessions = {}  # server_hostname -> SSLSession
+        self.handshake_timeout = HANDSHAKE_TIMEOUT
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                    server_hostname=None, session=None):
+        if session is None and server_hostname is not None:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+                                   suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname,
+                                   session=session)
+
+    def remember_session(self, sock):
+        """
+        在握手完成后或关闭前调用，TLS 1.3的会话票据要等收到数据后才有
+        """
+        session = getattr(sock, 'session', None)
+        hostname = getattr(sock, 'server_hostname', None)
+        if session is not None and hostname is not None:
+            self.sessions[hostname] = session
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+def get_tls_context() -> SessionCachingContext:
+    """
+    进程内所有连接共用的TLS上下文
+    打印机使用自签名证书，不校验证书和主机名，因此也不需要加载系统CA证书
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            context = SessionCachingContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            _context = context
+        return _context
@@ -0,0 +1,54 @@
+import time
+
+# check()返回的动作
+PROBE = 1 << 0  # 发送探测命令
+STALE = 1 << 1  # 标记状态过期
+RECONNECT = 1 << 2  # 强制重连
+
+
+class Watchdog:
+    """
+    按最后一次收到报告的时间判断连接是否还活着，比MQTT keepalive发现得快得多
+    报告停止probe_after秒后开始发送探测，stale_after秒后标记状态过期，reconnect_after秒后强制重连
+    探测的回复本身也是报告，打印机空闲时只要还能回复就不会被判为失效
+    """
+
+    def __init__(self, probe_after: float = 5, probe_interval: float = 2, stale_after: float = 10,
+                 reconnect_after: float = 15):
+        """
+        :param probe_after: 多久没有报告后开始探测（秒）
+        :param probe_interval: 探测的间隔（秒）
+        :param stale_after: 多久没有报告后标记状态过期（秒）
+        :param reconnect_after: 多久没有报告后强制重连（秒）
+        """
+        self.probe_after = probe_after
+        self.probe_interval = probe_interval
+        self.stale_after = stale_after
+        self.reconnect_after = reconnect_after
+
+        self.last_report = time.monotonic()
+        self.last_probe: float = 0
+
+    def feed(self, now: float):
+        """
+        收到报告或连接建立时调用
+        """
+        self.last_report = now
+
+    def check(self, now: float) -> int:
+        """
+        定时调用，间隔决定了检测精度
+        :return: 需要执行的动作，PROBE、STALE、RECONNECT的组合
+        """
+        silence = now - self.last_report
+        if silence >= self.reconnect_after:
+            self.last_report = now  # 给重连留出时间，不连续触发
+            return RECONNECT | STALE
+
+        action = 0
+        if silence >= self.stale_after:
+            action |= STALE
+        if silence >= self.probe_after and now - self.last_probe >= self.probe_interval:
+            self.last_probe = now
+            action |= PROBE
+        return action
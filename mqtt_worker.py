@@ -1,62 +1,51 @@
-import json
-from PySide6.QtCore import QThread, Signal, QObject
-import paho.mqtt.client as mqtt
-import mqtt_commands
+from PySide6.QtCore import Signal, QObject
 
+from mqtt_coalescer import DeltaCoalescer
+from mqtt_engine import MonitorEngine, EVENT_STATE
+from mqtt_state import StateDelta
 
-class MqttWorker(QObject):
-    message_received = Signal(str)  # 定义一个信号
 
-    def __init__(self, username: str, lan_code: str, sn: str, ip: str, port: int):
+class MqttWorker(QObject):
+    """
+    MonitorEngine的Qt适配层，把引擎的事件转成Qt信号
+    网络循环由引擎自己的线程负责，这里不再需要QThread
+    """
+    # 有新的状态增量待取，合并区从空变为非空时才发出，Qt事件队列里最多只有一个
+    state_changed = Signal()
+
+    def __init__(self, engine: MonitorEngine):
         super().__init__()
 
-        self.username = username
-        self.lan_code = lan_code
-        self.sn = sn
-        self.ip = ip
-        self.port = port
-
-        self.thread = None
-        self.client = mqtt.Client()
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.running = False
+        self.engine = engine
+        self.engine.add_listener(self.on_engine_event)
+        self.coalescer = DeltaCoalescer()
 
     def start(self):
-        self.running = True
-        self.thread = QThread()
-        self.moveToThread(self.thread)
-        self.thread.started.connect(self.run)
-        self.thread.start()
-
-    def run(self):
-        self.client.tls_set(ca_certs=None, cert_reqs=mqtt.ssl.CERT_NONE)
-        self.client.tls_insecure_set(True)
-        self.client.username_pw_set(self.username, self.lan_code)
-        self.client.connect(self.ip, self.port, 60)
-
-        while self.running:
-            self.client.loop_start()  # 注意这里可能需要根据实际情况调整
-        self.client.disconnect()
+        self.engine.start()
 
     def stop(self):
-        self.running = False
-        self.thread.quit()
-        self.thread.wait()
+        self.engine.stop()
+
+    def on_engine_event(self, event: str, data):
+        # 在网络线程中调用，信号会以队列方式投递到GUI线程
+        # 报告已在网络线程解析成StateDelta，GUI线程不再做json解析
+        if event == EVENT_STATE:
+            if self.coalescer.push(data):
+                self.state_changed.emit()
 
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
-            print("已连接到MQTT代理")
-            client.subscribe(f"device/{self.sn}/report")
-            self.push_all_messages()  # 推送全部信息
-        else:
-            print(f"连接失败 错误码 {rc}")
+    def take_delta(self) -> StateDelta:
+        """
+        取走合并后的状态增量，在GUI线程调用
+        """
+        return self.coalescer.take()
 
-    def on_message(self, client, userdata, msg):
-        self.message_received.emit(msg.payload.decode())
+    def publish_message(self, msg, key=None, priority=None):
+        # 只是放入发送队列，不会阻塞界面线程
+        return self.engine.publish_message(msg, key, priority)
 
-    def publish_message(self, msg):
-        self.client.publish(f"device/{self.sn}/request", msg)
+    def request(self, template: dict, param=None, timeout: float = None, callback=None):
+        # 回调在网络线程中执行，更新界面需要通过信号
+        return self.engine.request(template, param, timeout, callback=callback)
 
     def push_all_messages(self):
-        self.publish_message(json.dumps(mqtt_commands.PUSH_ALL))
+        return self.engine.push_all_messages()
@@ -0,0 +1,42 @@
+"""
+asyncio连接的重连循环
+"""
+import asyncio
+import ssl
+
+from mqtt_async import AsyncMqttConnection
+
+
+class FixedBackoff:
+    def next_delay(self) -> float:
+        return 0.01
+
+
+def test_connect_errors_do_not_end_reconnect_loop(capsys):
+    errors = [ValueError('Invalid host.'), ssl.SSLError('handshake failed'), OSError('refused')]
+    attempts = []
+
+    def connect(host, port, keepalive):
+        attempts.append(host)
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        raise RuntimeError('unexpected')
+
+    async def main():
+        connection = AsyncMqttConnection('bblp', 'code', 'SN', '127.0.0.1', 1)
+        connection.backoff = FixedBackoff()
+        connection.client.connect = connect
+        connection.start()
+        for _ in range(200):
+            if len(attempts) > len(errors) + 1:
+                break
+            await asyncio.sleep(0.01)
+        task = connection.connect_task
+        connection.stop()
+        return task
+
+    task = asyncio.run(main())
+    assert len(attempts) > len(errors) + 1
+    assert task.cancelled()
+    output = capsys.readouterr().out
+    assert 'ValueError' in output and 'SSLError' in output and 'RuntimeError' in output
@@ -0,0 +1,59 @@
+"""
+CommandEncoder的输出必须与json.dumps填好字段的模板逐字节相同
+"""
+import copy
+import json
+
+import pytest
+
+import mqtt_commands
+
+TEMPLATES = {name: value for name, value in vars(mqtt_commands).items()
+             if name.isupper() and not name.startswith('_') and isinstance(value, dict)}
+PARAMS = ('', '2', 'G28\nG1 X10 Y10 F3000\n', 'M117 "引号" \\ 反斜杠\t', 3)
+
+
+def dumps(template: dict, sequence_id=None, param=None) -> bytes:
+    (section, body), = template.items()
+    body = dict(body)
+    if sequence_id is not None:
+        body['sequence_id'] = str(sequence_id)
+    if param is not None:
+        body['param'] = param
+    return json.dumps({section: body}).encode()
+
+
+def test_every_template_is_covered():
+    assert {'PAUSE', 'RESUME', 'STOP', 'PUSH_ALL', 'GET_VERSION', 'SEND_GCODE_TEMPLATE',
+            'SPEED_PROFILE_TEMPLATE', 'CHAMBER_LIGHT_ON'} <= set(TEMPLATES)
+
+
+@pytest.mark.parametrize('name', sorted(TEMPLATES))
+def test_encode_matches_json_dumps(name):
+    template = TEMPLATES[name]
+    original = copy.deepcopy(template)
+    encoder = mqtt_commands.encoder(template)
+    (section, body), = template.items()
+    assert (encoder.section, encoder.command) == (section, body['command'])
+
+    assert encoder.encode() == dumps(template)
+    for sequence_id in ('1', 12345, '"9"'):
+        assert encoder.encode(sequence_id) == dumps(template, sequence_id)
+    if 'param' in body:
+        for param in PARAMS:
+            assert encoder.encode('7', param) == dumps(template, '7', param)
+    else:
+        with pytest.raises(ValueError):
+            encoder.encode('7', 'x')
+    assert template == original
+
+
+def test_encoder_is_cached_per_template():
+    assert mqtt_commands.encoder(mqtt_commands.PAUSE) is mqtt_commands.encoder(mqtt_commands.PAUSE)
+    assert mqtt_commands.encoder(mqtt_commands.PAUSE) is not mqtt_commands.encoder(mqtt_commands.RESUME)
+    # 调用方构造的字典不缓存
+    cached = len(mqtt_commands._encoders)
+    other = copy.deepcopy(mqtt_commands.PAUSE)
+    assert mqtt_commands.encoder(other) is not mqtt_commands.encoder(other)
+    assert mqtt_commands.encoder(other).encode('1') == mqtt_commands.encoder(mqtt_commands.PAUSE).encode('1')
+    assert len(mqtt_commands._encoders) == cached
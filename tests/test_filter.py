@@ -0,0 +1,59 @@
+"""
+不完整解析报告，只靠顶层键名和command决定是否丢弃
+"""
+import pytest
+
+from mqtt_filter import ReportFilter, classify
+
+
+@pytest.mark.parametrize('payload, expected', [
+    (b'{"print":{"command":"push_status","msg":1}}', ('print', 'push_status')),
+    (b' \n{ "info" : {"sequence_id": "3", "command" : "get_version"}}', ('info', 'get_version')),
+    # 嵌套对象之后的command不能确定层级，交给完整解析
+    (b'{"print":{"upload":{"status":"idle"},"command":"push_status"}}', ('print', None)),
+    (b'{"print":{"job":{"command":"gcode_line"},"msg":1}}', ('print', None)),
+    (b'{"print":{"a":1},"info":{"command":"get_version"}}', ('print', None)),
+    (b'{"print":{"note":"{","command":"pause"}}', ('print', None)),
+    (b'{"print":"text","command":"pause"}', ('print', None)),
+    (b'{"system":{"sequence_id":"1"}}', ('system', None)),
+    (b'{"print":{"command":""}}', ('print', '')),
+    (b'[1, 2]', (None, None)),
+    (b'not json', (None, None)),
+    (b'', (None, None)),
+])
+def test_classify(payload, expected):
+    assert classify(payload) == expected
+
+
+def test_wants_only_subscribed_reports():
+    report_filter = ReportFilter()
+    report_filter.subscribe('print', 'push_status', print)
+    assert report_filter.wants(b'{"print":{"command":"push_status"}}')
+    assert not report_filter.wants(b'{"print":{"command":"gcode_line","sequence_id":"5"}}')
+    assert not report_filter.wants(b'{"info":{"command":"get_version"}}')
+    # 无法识别的报告交给完整解析
+    assert report_filter.wants(b'{"system":{"sequence_id":"1"}}')
+    assert report_filter.wants(b'garbage')
+    # 嵌套对象里的command不能让push_status被当成别的报告丢掉
+    assert report_filter.wants(b'{"print":{"job":{"command":"gcode_line"},"command":"push_status"}}')
+
+
+def test_section_wide_subscription_and_match_order():
+    report_filter = ReportFilter()
+    calls = []
+    specific = calls.append
+    section_wide = calls.extend
+    report_filter.subscribe('info', None, section_wide)
+    report_filter.subscribe('info', 'get_version', specific)
+    assert report_filter.wants(b'{"info":{"command":"anything"}}')
+    assert report_filter.match('info', 'get_version') == [specific, section_wide]
+    assert report_filter.match('info', None) == [section_wide]
+
+
+def test_unsubscribe():
+    report_filter = ReportFilter()
+    report_filter.subscribe('print', 'pause', print)
+    report_filter.unsubscribe('print', 'pause', print)
+    report_filter.unsubscribe('print', 'pause', print)  # 重复取消不报错
+    assert not report_filter.handlers
+    assert not report_filter.wants(b'{"print":{"command":"pause"}}')
@@ -0,0 +1,20 @@
+"""
+主窗口的刷新帧率配置
+"""
+import math
+
+import pytest
+
+pytest.importorskip('PySide6')
+
+from mqtt_mainwindow import DEFAULT_MAX_FPS, frame_interval  # noqa: E402
+
+
+@pytest.mark.parametrize('max_fps, expected', [(10, 0.1), (30, 1 / 30), ('5', 0.2)])
+def test_frame_interval(max_fps, expected):
+    assert math.isclose(frame_interval(max_fps), expected)
+
+
+@pytest.mark.parametrize('max_fps', [0, -5, None, 'fast', math.inf, math.nan])
+def test_invalid_max_fps_uses_default(max_fps):
+    assert frame_interval(max_fps) == 1 / DEFAULT_MAX_FPS
@@ -0,0 +1,206 @@
+"""
+按sequence_id匹配回复、超时和断线，以及通过ReplaySource驱动MonitorEngine的完整流程
+"""
+import json
+import threading
+
+import pytest
+
+import mqtt_commands
+from mqtt_engine import MonitorEngine
+from mqtt_gcode import GcodeStreamer
+from mqtt_pending import CommandTimeout, PendingRequests
+from mqtt_queue import CANCELLED, SENT, SENDING, CommandQueue
+from mqtt_replay import ReplaySource
+
+
+class MessageInfo:
+    # paho的MQTTMessageInfo只用到rc
+    def __init__(self, rc: int):
+        self.rc = rc
+
+
+def test_sequence_ids_increase():
+    pending = PendingRequests()
+    ids = [int(pending.add('pause').sequence_id) for _ in range(3)]
+    assert ids == sorted(ids) and len(set(ids)) == 3
+    assert len(pending) == 3
+
+
+def test_resolve_matches_sequence_id_and_command():
+    pending = PendingRequests()
+    request = pending.add('pause')
+    assert not pending.resolve({'sequence_id': request.sequence_id, 'command': 'resume'})
+    assert not pending.resolve({'sequence_id': '999', 'command': 'pause'})
+    reply = {'sequence_id': request.sequence_id, 'command': 'pause', 'result': 'success'}
+    assert pending.resolve(reply)
+    assert request.future.result(0) is reply
+    assert len(pending) == 0
+    assert pending.rtt_summary()['pause']['count'] == 1
+    assert not pending.resolve(reply)  # 重复的回复
+
+
+def test_expire_fails_with_timeout_and_cancels_queued_command():
+    pending = PendingRequests()
+    queue = CommandQueue()
+    request = pending.add('pause', timeout=5)
+    later = pending.add('resume', timeout=60)
+    pending.sent(request, queue.put('pause'))
+
+    pending.expire(request.deadline - 1)
+    assert not request.future.done()
+    pending.expire(request.deadline)
+    with pytest.raises(CommandTimeout):
+        request.future.result(0)
+    assert request.handle.status == CANCELLED
+    assert queue.take(10) == []
+    assert not later.future.done()
+    assert len(pending) == 1
+
+
+def test_expire_before_handle_is_known():
+    # 超时发生在publish返回之前，句柄交回时再取消
+    pending = PendingRequests()
+    queue = CommandQueue()
+    request = pending.add('pause', timeout=0)
+    pending.expire(request.deadline)
+    handle = queue.put('pause')
+    pending.sent(request, handle)
+    assert handle.status == CANCELLED
+
+
+def test_disconnected_fails_only_written_commands():
+    pending = PendingRequests()
+    queue = CommandQueue()
+    written = pending.add('pause')
+    waiting = pending.add('resume')
+    pending.sent(written, queue.put('pause'))
+    pending.sent(waiting, queue.put('resume'))
+    queue.take(1)
+    queue.sent(written.handle)
+
+    pending.disconnected()
+    with pytest.raises(ConnectionError):
+        written.future.result(0)
+    assert written.handle.status == SENT
+    assert not waiting.future.done()
+    assert waiting.handle.status != CANCELLED
+
+
+def test_disconnected_fails_paho_message_info():
+    # asyncio客户端直接交给paho，没有发送队列，断开后不会再有回复
+    pending = PendingRequests()
+    queue = CommandQueue()
+    published = pending.add('pause')
+    pending.sent(published, MessageInfo(0))
+    sending = pending.add('resume')
+    pending.sent(sending, queue.put('resume'))
+    queue.take(1)
+    not_yet = pending.add('stop')  # publish还没返回
+
+    pending.disconnected()
+    for request in (published, sending):
+        with pytest.raises(ConnectionError):
+            request.future.result(0)
+    assert not not_yet.future.done()
+
+
+def test_sent_fails_dropped_or_rejected_commands():
+    pending = PendingRequests()
+    dropped = pending.add('pause')
+    pending.sent(dropped, CommandQueue(maxsize=0).put('pause'))
+    with pytest.raises(ConnectionError):
+        dropped.future.result(0)
+
+    rejected = pending.add('pause')
+    pending.sent(rejected, MessageInfo(4))
+    with pytest.raises(ConnectionError):
+        rejected.future.result(0)
+
+    accepted = pending.add('pause')
+    pending.sent(accepted, MessageInfo(0))
+    assert not accepted.future.done()
+
+
+def test_cancel_does_not_touch_sending_command():
+    pending = PendingRequests()
+    queue = CommandQueue()
+    request = pending.add('pause', timeout=0)
+    pending.sent(request, queue.put('pause'))
+    queue.take(1)
+    pending.expire(request.deadline)
+    assert request.handle.status == SENDING
+
+
+def write_jsonl(path, reports) -> str:
+    path.write_text('\n'.join(json.dumps(report) for report in reports) + '\n')
+    return str(path)
+
+
+def replay_engine(path: str, timeout: float = 10):
+    source = ReplaySource(path, speed=0)
+    finished = threading.Event()
+    source.on_finished = finished.set
+    return MonitorEngine(source, pending=PendingRequests(timeout)), finished
+
+
+def test_replay_resolves_request(tmp_path):
+    path = write_jsonl(tmp_path / 'reply.jsonl', [
+        {'print': {'command': 'push_status', 'msg': 1, 'mc_percent': 10}},
+        {'print': {'command': 'pause', 'sequence_id': '1', 'result': 'success'}},
+    ])
+    engine, finished = replay_engine(path)
+    future = engine.request(mqtt_commands.PAUSE)
+    engine.start()
+    assert future.result(5)['result'] == 'success'
+    assert finished.wait(5)
+    engine.stop()
+    assert engine.state.task_percent == 10
+    assert json.loads(engine.connection.published[0]) == {'print': {'sequence_id': '1', 'command': 'pause'}}
+    assert len(engine.pending) == 0
+
+
+def test_replay_request_times_out_without_socket(tmp_path):
+    # 回放不会调用on_tick，超时由连接的定时器检查
+    path = write_jsonl(tmp_path / 'silent.jsonl', [{'print': {'command': 'push_status', 'msg': 1}}])
+    engine, finished = replay_engine(path)
+    engine.start()
+    assert finished.wait(5)
+    future = engine.request(mqtt_commands.STOP, timeout=0.2)
+    with pytest.raises(CommandTimeout):
+        future.result(5)
+    engine.stop()
+    assert len(engine.pending) == 0
+
+
+def test_gcode_streamer_finishes_when_replies_never_come(tmp_path):
+    gcode = tmp_path / 'part.gcode'
+    gcode.write_text('G28\nG1 X10 Y10\n' * 100)
+    path = write_jsonl(tmp_path / 'silent.jsonl', [{'print': {'command': 'push_status', 'msg': 1}}])
+    engine, finished = replay_engine(path)
+    engine.start()
+    streamer = GcodeStreamer(engine, str(gcode), batch_bytes=64, window=2, timeout=0.2)
+    streamer.start()
+    assert streamer.wait(5)
+    assert isinstance(streamer.error, CommandTimeout)
+    assert streamer.lines_acked == 0
+    engine.stop()
+
+
+
+def test_concurrent_first_requests_subscribe_once(tmp_path):
+    path = write_jsonl(tmp_path / 'empty.jsonl', [])
+    engine, finished = replay_engine(path)
+    barrier = threading.Barrier(8)
+
+    def first_request():
+        barrier.wait()
+        engine.request(mqtt_commands.GET_VERSION)
+
+    threads = [threading.Thread(target=first_request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert engine.report_filter.match('info', 'get_version') == [engine.on_reply]
+    assert len(engine.pending) == 8
@@ -0,0 +1,167 @@
+"""
+发送队列的满队列策略、优先级通道和取消
+"""
+import threading
+import time
+
+import pytest
+
+import mqtt_commands
+from mqtt_queue import (BLOCK, BULK, CANCELLED, COALESCE, DROP, DROPPED, NORMAL, QUEUED, REPLACED, SENDING, SENT,
+                        URGENT, CommandQueue, command_priority)
+
+
+def fill(queue: CommandQueue, count: int, priority: int = NORMAL) -> list:
+    return [queue.put(f'msg{i}', priority=priority) for i in range(count)]
+
+
+def test_take_urgent_lane_first():
+    queue = CommandQueue()
+    bulk = queue.put('gcode', priority=BULK)
+    normal = queue.put('light', priority=NORMAL)
+    urgent = queue.put('stop', priority=URGENT)
+    assert queue.take(10) == [urgent, normal, bulk]
+    assert len(queue) == 0
+    assert all(handle.status == SENDING for handle in (urgent, normal, bulk))
+
+
+def test_take_fifo_within_lane_and_max_items():
+    queue = CommandQueue()
+    handles = fill(queue, 5, BULK)
+    assert queue.take(2) == handles[:2]
+    assert queue.take(10) == handles[2:]
+
+
+def test_command_priority_by_name():
+    for template, priority in ((mqtt_commands.STOP, URGENT), (mqtt_commands.PAUSE, URGENT),
+                               (mqtt_commands.RESUME, URGENT), (mqtt_commands.SEND_GCODE_TEMPLATE, BULK),
+                               (mqtt_commands.PUSH_ALL, BULK), (mqtt_commands.GET_VERSION, NORMAL)):
+        assert command_priority(mqtt_commands.encoder(template).encode()) == priority
+    assert command_priority(b'not json') == NORMAL
+
+
+def test_default_policy_never_blocks():
+    queue = CommandQueue(maxsize=2)
+    assert queue.policy == COALESCE
+    fill(queue, 2)
+    t0 = time.monotonic()
+    handle = queue.put('extra')
+    assert time.monotonic() - t0 < 0.5
+    assert handle.status == DROPPED
+    assert len(queue) == 2
+
+
+def test_coalesce_replaces_same_key():
+    queue = CommandQueue(maxsize=2)
+    first = queue.put('pushall 1', key='pushall', priority=BULK)
+    second = queue.put('pushall 2', key='pushall', priority=BULK)
+    assert first.status == REPLACED and first.done()
+    assert len(queue) == 1
+    assert queue.take(10) == [second]
+
+
+def test_drop_policy():
+    queue = CommandQueue(maxsize=1, policy=DROP)
+    kept = queue.put('a', key='k')
+    dropped = queue.put('b', key='k')
+    assert kept.status == QUEUED
+    assert dropped.status == DROPPED
+    assert not dropped.wait(0)
+
+
+def test_urgent_ignores_capacity():
+    for policy in (BLOCK, DROP, COALESCE):
+        queue = CommandQueue(maxsize=2, policy=policy, block_timeout=0)
+        fill(queue, 2, BULK)
+        stop = queue.put('stop', priority=URGENT)
+        assert stop.status == QUEUED
+        assert queue.take(1) == [stop]
+
+
+def test_block_policy_times_out():
+    queue = CommandQueue(maxsize=1, policy=BLOCK, block_timeout=0.1)
+    fill(queue, 1)
+    t0 = time.monotonic()
+    handle = queue.put('late')
+    assert handle.status == DROPPED
+    assert 0.05 < time.monotonic() - t0 < 1
+    assert queue.put('late', block=False).status == DROPPED
+
+
+def test_block_policy_waits_for_take():
+    queue = CommandQueue(maxsize=1, policy=BLOCK, block_timeout=5)
+    fill(queue, 1)
+    timer = threading.Timer(0.1, queue.take, (1,))
+    timer.start()
+    handle = queue.put('next')
+    timer.join()
+    assert handle.status == QUEUED
+    assert len(queue) == 1
+
+
+@pytest.mark.parametrize('kwargs', [{'policy': 'wait'}, {'block_timeout': None}, {'block_timeout': -1}])
+def test_invalid_arguments(kwargs):
+    with pytest.raises(ValueError):
+        CommandQueue(**kwargs)
+
+
+def test_cancelled_commands_are_skipped():
+    queue = CommandQueue()
+    first, second = fill(queue, 2)
+    assert first.cancel()
+    assert first.status == CANCELLED and first.done()
+    assert queue.take(10) == [second]
+    assert len(queue) == 0
+    assert not second.cancel()  # 已经交给paho
+
+
+def test_full_queue_purges_cancelled():
+    queue = CommandQueue(maxsize=2, policy=DROP)
+    handles = fill(queue, 2)
+    handles[0].cancel()
+    handle = queue.put('new')
+    assert handle.status == QUEUED
+    assert len(queue) == 2
+    assert queue.take(10) == [handles[1], handle]
+
+
+def test_coalesce_does_not_replace_cancelled():
+    queue = CommandQueue()
+    old = queue.put('pushall 1', key='pushall')
+    old.cancel()
+    new = queue.put('pushall 2', key='pushall')
+    assert old.status == CANCELLED
+    assert queue.take(10) == [new]
+
+
+def test_sent_records_lane_latency():
+    queue = CommandQueue()
+    handle = queue.put('stop', priority=URGENT)
+    queue.take(1)
+    queue.sent(handle)
+    assert handle.status == SENT and handle.wait(0)
+    assert queue.latency_summary()['urgent']['count'] == 1
+    assert queue.latency_summary()['bulk']['count'] == 0
+
+
+def test_cancel_and_take_race():
+    # 取消成功与被取出恰好发生一个，调用方得到失败结果的命令不会再发出去
+    queue = CommandQueue(maxsize=1000)
+    for _ in range(200):
+        handles = fill(queue, 50)
+        cancelled = []
+        taken = []
+        barrier = threading.Barrier(2)
+
+        def cancel_all():
+            barrier.wait()
+            cancelled.extend(handle for handle in handles if handle.cancel())
+
+        thread = threading.Thread(target=cancel_all)
+        thread.start()
+        barrier.wait()
+        while len(queue):
+            taken.extend(queue.take(5))
+        thread.join()
+        assert not set(map(id, cancelled)) & set(map(id, taken))
+        assert len(cancelled) + len(taken) == len(handles)
@@ -0,0 +1,74 @@
+"""
+PrinterState.merge返回的变化掩码，以及ams增量的合并
+"""
+import mqtt_state
+from mqtt_state import PrinterState, StateDelta
+
+
+def test_merge_reports_only_changed_fields():
+    state = PrinterState()
+    mask = state.merge({'command': 'push_status', 'nozzle_temper': 220.5, 'mc_percent': 10, 'unknown_key': 1})
+    assert mask == mqtt_state.NOZZLE_TEMPERATURE | mqtt_state.TASK_PERCENT
+    assert state.nozzle_temperature == 220.5
+    assert state.merge({'nozzle_temper': 220.5, 'mc_percent': 10}) == 0
+    assert state.merge({'mc_percent': 11}) == mqtt_state.TASK_PERCENT
+
+
+def test_merge_large_report_uses_same_table():
+    state = PrinterState()
+    report = {f'extra_{i}': i for i in range(50)}
+    report.update({'bed_temper': 60, 'subtask_name': 'part'})
+    assert state.merge(report) == mqtt_state.HOTBED_TEMPERATURE | mqtt_state.TASK_NAME
+
+
+def test_merge_converts_and_skips_bad_values():
+    state = PrinterState()
+    assert state.merge({'cooling_fan_speed': '15', 'big_fan1_speed': '0'}) == \
+        mqtt_state.PART_COOLING_FAN | mqtt_state.AUX_FAN
+    assert (state.part_cooling_fan, state.aux_fan) == (100, 0)
+    assert state.merge({'cooling_fan_speed': 'fast', 'hms': [{'attr': 1}]}) == mqtt_state.HMS
+    assert state.part_cooling_fan == 100
+    assert state.hms == ({'attr': 1},)
+
+
+def test_ams_partial_report_is_merged():
+    state = PrinterState()
+    full = {'ams': [{'id': '0', 'humidity': '4', 'tray': [{'id': '0', 'tray_type': 'PLA'},
+                                                          {'id': '1', 'tray_type': 'PETG'}]}],
+            'tray_now': '0'}
+    assert state.merge({'ams': full}) == mqtt_state.AMS
+    before = state.ams
+
+    assert state.merge({'ams': {'tray_now': '1'}}) == mqtt_state.AMS
+    assert state.ams['tray_now'] == '1'
+    assert state.ams['ams'] == full['ams']
+
+    state.merge({'ams': {'ams': [{'id': '0', 'tray': [{'id': '1', 'remain': 80}]}]}})
+    unit = state.ams['ams'][0]
+    assert unit['humidity'] == '4'
+    assert unit['tray'] == [{'id': '0', 'tray_type': 'PLA'}, {'id': '1', 'tray_type': 'PETG', 'remain': 80}]
+    # 已经发出的增量引用的旧对象不变
+    assert before['tray_now'] == '0'
+    assert 'remain' not in before['ams'][0]['tray'][1]
+
+    assert state.merge({'ams': {'tray_now': '1'}}) == 0
+    assert state.merge({'ams': 'broken'}) == 0
+
+
+def test_delta_pack_and_apply():
+    state = PrinterState()
+    mask = state.merge({'mc_percent': 50, 'layer_num': 3})
+    delta = state.delta(mask)
+    unpacked = StateDelta.unpack(delta.pack())
+    assert unpacked.mask == mask and unpacked.values == {'task_percent': 50, 'curr_layer': 3}
+
+    replica = PrinterState()
+    assert replica.apply(unpacked) == mask
+    assert replica.apply(unpacked) == 0
+
+
+def test_set_stale():
+    state = PrinterState()
+    assert state.set_stale(True) == mqtt_state.STALE
+    assert state.set_stale(True) == 0
+    assert state.merge({'mc_percent': 1}) & mqtt_state.STALE == 0